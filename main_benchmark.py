@@ -0,0 +1,211 @@
+import argparse
+import os
+import json
+import time
+import random
+import shutil
+import platform
+import subprocess
+
+import numpy as np
+
+from vary.model.files.directory import create_temporary_copy, create_dir, set_build_root
+from vary.model.files.results import open_result_sink
+from vary.model.files.tex_injection import inject_space_indicator, get_remaining_space
+from vary.model.generation.compile import generate_bbl, compile_latex, CompilationError
+from vary.model.generation.inject import write_variables
+from vary.model.generation.analyze_pdf import page_count
+from vary.model.generation.preamble import get_pdflatex_version
+from vary.model.generation.sampling import sample_configs
+from vary.model.decision_trees.analysis import decision_tree, eval_options
+
+EXAMPLE_SOURCE = os.path.join("vary", "example", "fse")
+EXAMPLE_FILENAME = "VaryingVariability-FSE15"
+BENCHMARK_FOLDER = os.path.join("vary", "build", "benchmark")
+PERCENTILES = [50, 90, 99]
+
+
+def summarize(durations):
+    """
+    Gets the statistics of the durations of a stage, in seconds, and its throughput in runs per minute.
+    """
+    durations = np.array(durations)
+    summary = {
+        "total": durations.sum(),
+        "mean": durations.mean(),
+        "min": durations.min(),
+        "max": durations.max(),
+    }
+    for p in PERCENTILES:
+        summary[f"p{p}"] = np.percentile(durations, p)
+    summary["perMinute"] = 60 / summary["mean"] if summary["mean"] else None
+    summary = {k: float(v) if v is not None else None for k, v in summary.items()}
+    summary["count"] = len(durations)
+    return summary
+
+
+def measure(stages, name, fn, *args):
+    """
+    Runs fn(*args), adds its duration to the stage and returns its result.
+    """
+    start = time.perf_counter()
+    result = fn(*args)
+    stages.setdefault(name, []).append(time.perf_counter() - start)
+    return result
+
+
+def synthetic_row(config, rng):
+    """
+    Adds random measures to a config, for the stages that do not need real documents.
+    """
+    row = config.copy()
+    row["nbPages"] = rng.randint(8, 11)
+    row["space"] = rng.uniform(-50, 500)
+    row["nbPasses"] = 1
+    return row
+
+
+def benchmark_documents(stages, errors, source, filename, configs, runs):
+    """
+    Times the stages that build documents : copy of the project, injection of the space indicator, generation
+    of the bibliography, compilation of the variants and analysis of their PDF.
+    Returns the rows of the variants that have been compiled.
+    """
+    rows = []
+    for run in range(runs):
+        temp_path = measure(stages, "workspaceCopy", create_temporary_copy, source)
+        file_path = os.path.join(temp_path, filename)
+        try:
+            measure(stages, "injection", inject_space_indicator, file_path)
+            try:
+                measure(stages, "bblGeneration", generate_bbl, file_path)
+            except OSError as e:
+                errors["bblGeneration"] = str(e)
+                continue
+            # The variants are shared between the runs
+            for config in configs[run::runs]:
+                try:
+                    write_variables(config, temp_path)
+                    measure(stages, "compile", compile_latex, os.path.join(temp_path, filename + ".tex"))
+                except OSError as e:
+                    errors["compile"] = str(e)
+                    break
+                except CompilationError as e:
+                    errors["compile"] = str(e)
+                    continue
+                row = config.copy()
+                try:
+                    row["nbPages"] = measure(stages, "pageAnalysis", page_count, file_path + ".pdf")
+                    row["space"] = get_remaining_space(temp_path)
+                except (OSError, ValueError, RuntimeError) as e:
+                    # The variant produced no readable PDF (PyMuPDF raises RuntimeError) or no space indicator
+                    errors["pageAnalysis"] = str(e)
+                    continue
+                rows.append(row)
+        finally:
+            shutil.rmtree(temp_path)
+    return rows
+
+
+def benchmark_results(stages, conf_source, rows, max_pages, nb_queries, rng):
+    """
+    Times the stages that use the results : writing the rows in a CSV file, training the decision tree and
+    evaluating the options of partial configs with eval_options.
+    """
+    create_dir(BENCHMARK_FOLDER)
+    csv_path = os.path.join(BENCHMARK_FOLDER, "result.csv")
+    with open_result_sink(csv_path, conf_source) as write_row:
+        for row in rows:
+            measure(stages, "csvWrite", write_row, row)
+
+    classifier, features = measure(stages, "treeTraining", decision_tree, csv_path, max_pages)
+
+    for config in sample_configs(conf_source, nb_queries, seed=rng.randrange(2 ** 32)):
+        # The configurator sends the values that have been chosen so far
+        partial = {k: v for k, v in config.items() if rng.random() < 0.3}
+        measure(stages, "evalOptions", eval_options, classifier, partial, conf_source, features)
+    os.remove(csv_path)
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        ).stdout.decode().strip() or None
+    except OSError:
+        return None
+
+
+def compare(report, previous):
+    """
+    Prints the median duration of every stage in both reports and the ratio between them.
+    """
+    print(f"{'stage':<16}{'before (s)':>14}{'after (s)':>14}{'ratio':>10}")
+    for name, stats in report["stages"].items():
+        before = previous["stages"].get(name)
+        if before:
+            ratio = stats["p50"] / before["p50"] if before["p50"] else float("nan")
+            print(f"{name:<16}{before['p50']:>14.6f}{stats['p50']:>14.6f}{ratio:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Times each stage of the generation and of the analysis on the bundled FSE example"
+    )
+    parser.add_argument("-s", "--source", default=EXAMPLE_SOURCE, help="Path of the LaTeX source folder")
+    parser.add_argument("-f", "--filename", default=EXAMPLE_FILENAME, help="Name of the main file")
+    parser.add_argument("-n", "--variants", default=20, type=int, help="Amount of variants compiled")
+    parser.add_argument("-r", "--runs", default=3, type=int,
+                        help="Amount of working directories created (copy, injection and bibliography)")
+    parser.add_argument("--rows", default=2000, type=int,
+                        help="Amount of synthetic rows used to time the CSV writing and the tree training")
+    parser.add_argument("-q", "--queries", default=50, type=int, help="Amount of eval_options calls")
+    parser.add_argument("-p", "--maxpages", default=10, type=int, help="Page limit of the decision tree")
+    parser.add_argument("--seed", default=0, type=int, help="Seed of the synthetic configs")
+    parser.add_argument("--skip-compile", action="store_true",
+                        help="Only time the stages that do not need LaTeX")
+    parser.add_argument("--build-root", default=os.path.join("vary", "build"),
+                        help="Folder of the working directories, a tmpfs such as /dev/shm/vary keeps them in memory")
+    parser.add_argument("-o", "--output", help="Path of the JSON report (printed if not set)")
+    parser.add_argument("-c", "--compare", help="Path of a previous JSON report to compare the medians with")
+    args = parser.parse_args()
+
+    set_build_root(args.build_root)
+    rng = random.Random(args.seed)
+    with open(os.path.join(args.source, "variables.json")) as f:
+        conf_source = json.load(f)
+
+    stages = {}
+    errors = {}
+    rows = []
+    if not args.skip_compile:
+        configs = sample_configs(conf_source, args.variants, seed=args.seed)
+        rows = benchmark_documents(stages, errors, args.source, args.filename, configs, max(1, args.runs))
+    synthetic_configs = sample_configs(conf_source, max(0, args.rows - len(rows)), seed=args.seed + 1)
+    rows += [synthetic_row(config, rng) for config in synthetic_configs]
+    benchmark_results(stages, conf_source, rows, args.maxpages, args.queries, rng)
+
+    report = {
+        "commit": get_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pdflatex": get_pdflatex_version().split("\n")[0],
+        "parameters": vars(args),
+        "stages": {name: summarize(durations) for name, durations in stages.items()},
+        "errors": errors
+    }
+    # A variant is compiled then analyzed
+    if "compile" in stages and "pageAnalysis" in stages:
+        variant_time = report["stages"]["compile"]["mean"] + report["stages"]["pageAnalysis"]["mean"]
+        report["variantsPerMinute"] = 60 / variant_time
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
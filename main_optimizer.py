@@ -3,15 +3,16 @@ import os
 import json
 import shutil
 
-import pandas as pd
-from pandas.core.common import flatten
-
-from vary.model.overleaf_util import fetch_overleaf
-from vary.model.files.directory import clear_directory, create_temporary_copy, create_dir
-from vary.model.files.tex_injection import inject_space_indicator
-from vary.model.generation.generate import generate_random, generate_pdf
-from vary.model.generation.compile import generate_bbl
+from vary.model.overleaf_util import fetch_overleaf, OVERLEAF_URL
+from vary.model.files.directory import create_dir, set_build_root
+from vary.model.files.results import open_result_sink, RESULT_COLUMNS
+from vary.model.generation.generate import generate_pdf, generate_rows, prepare_workspaces, \
+    load_cached_row, prune_unused_variables
+from vary.model.generation.cache import hash_sources
+from vary.model.generation.sampling import batch_sampler, SAMPLING_METHODS
 from vary.model.decision_trees.analysis import decision_tree
+from vary.model.decision_trees.active_learning import active_learning_sampler
+from vary.model.decision_trees.optimizer import optimizer_sampler, best_row
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -29,63 +30,147 @@ if __name__ == "__main__":
     parser.add_argument("-ol", "--overleaf",
                         help="Key of the readonly link of the project on Overleaf (the letters avter '/read/'). \
                         It needs to have a 'values.json' file and the document must include 'macros' and 'values'")
+    parser.add_argument("--overleaf-url", default=OVERLEAF_URL, help="Address of the Overleaf server")
     parser.add_argument("-c", "--config", help="Generate a specific PDF from a config JSON string")
     parser.add_argument("-p", "--maxpages", type=int, help="The maximum amount of pages accepted for the document")
+    parser.add_argument("-j", "--jobs", default=1, type=int,
+                        help="Amount of PDFs compiled in parallel, each one in its own working directory")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always compile the documents and the bibliography instead of reusing the results cached \
+                        for the same sources")
+    parser.add_argument("--no-format", action="store_true",
+                        help="Load the whole preamble for every PDF instead of using a precompiled format")
+    parser.add_argument("-m", "--measure-only", action="store_true",
+                        help="Only measure the randomly generated documents, without writing their PDF")
+    parser.add_argument("-f", "--format", choices=["csv", "parquet"], default="csv",
+                        help="Format of the result file (Parquet keeps the types of the columns but needs pyarrow)")
+    parser.add_argument("--sampling", choices=SAMPLING_METHODS + ["active"], default="random",
+                        help="How the configs are chosen : randomly, with a Latin hypercube, with a pairwise covering \
+                        array, by enumerating all of them (if there are at most GENERATIONS configs), or near the \
+                        page limit with active learning (which needs --maxpages and may stop before the amount of \
+                        generations once the tree is accurate enough). The configs are never built twice")
+    parser.add_argument("-t", "--timings", action="store_true",
+                        help="Add the time spent in the stages of each generation to the result file")
+    parser.add_argument("--optimize", action="store_true",
+                        help="Search a config that fits in --maxpages with as few compilations as possible (at most \
+                        GENERATIONS) instead of sampling the configs, and build its PDF")
+    parser.add_argument("--patience", default=0, type=int,
+                        help="With --optimize, amount of configs built after the first fitting one to look for a \
+                        tighter fit")
+    parser.add_argument("--fixed", default="{}",
+                        help="JSON string of the values that are kept in every generated config")
+    parser.add_argument("--prune-unused", action="store_true",
+                        help="Do not sample the variables that the document never reads")
+    parser.add_argument("--build-root", default=os.path.join("vary", "build"),
+                        help="Folder of the working directories, a tmpfs such as /dev/shm/vary keeps them in memory")
     args = parser.parse_args()
+    if args.sampling == "active" and not args.maxpages:
+        parser.error("--sampling active requires --maxpages")
+    if args.optimize and not args.maxpages:
+        parser.error("--optimize requires --maxpages")
+    fixed_values = json.loads(args.fixed)
+    set_build_root(args.build_root)
 
     document_path = args.source
     filename = args.filename.replace(".tex","")
 
     if args.overleaf:
-        clear_directory(document_path)
-        fetch_overleaf(args.overleaf, document_path)
-
-    temp_path = create_temporary_copy(document_path)
+        # Only the files that changed since the previous fetch are replaced
+        written, removed = fetch_overleaf(args.overleaf, document_path, args.overleaf_url)
+        if args.verbose:
+            print(f"{len(written)} files updated and {len(removed)} files removed from Overleaf")
 
     conf_source_path = os.path.join(document_path, "variables.json")
     with open(conf_source_path) as f:
         conf_source = json.load(f)
+    if args.prune_unused:
+        conf_source = prune_unused_variables(conf_source, os.path.join(document_path, filename + ".tex"))
 
-    # DataFrame initialisation 
-    cols = conf_source["booleans"] + \
-        list(conf_source["numbers"].keys()) + \
-        list(conf_source["enums"].keys()) + \
-        list(flatten(conf_source["choices"])) + \
-        ["nbPages", "space"]
-    df = pd.DataFrame(columns=cols)
-
-    file_path = os.path.join(temp_path, filename)
-    inject_space_indicator(file_path)
-    # LaTeX bbl pregeneration
-    generate_bbl(file_path)
+    source_hash = None if args.no_cache else hash_sources(document_path)
+    # Working directories with the space indicator and the bibliography
+    workspaces = []
 
     # ----------------------------------------
     # PDF generation
     # ----------------------------------------
-    if args.config:
-        row = generate_pdf(json.loads(args.config), filename, temp_path)
-        pdf_name = filename+".pdf"
-        shutil.copyfile(os.path.join(temp_path, pdf_name), os.path.join(args.output, pdf_name))
-    else:
-        for i in range(args.generations):
-            row = generate_random(conf_source, filename, temp_path)
-            df = df.append(row, ignore_index=True)
-            if args.verbose:
-                print(f"Doc {i} generated")
+    try:
+        if args.config:
+            config = json.loads(args.config)
+            pdf_name = filename+".pdf"
+            create_dir(args.output)
+            pdf_path = os.path.join(args.output, pdf_name)
+            # The working directory is only needed if the document is not in the cache
+            if not source_hash or load_cached_row(config, filename, source_hash, pdf_path) is None:
+                workspaces = prepare_workspaces(document_path, filename, 1, not args.no_format, not args.no_cache)
+                row = generate_pdf(config, filename, workspaces[0], source_hash, cache_pdf=True)
+                if row.get("failure"):
+                    print("The document could not be built :", row["failure"])
+                else:
+                    shutil.copyfile(os.path.join(workspaces[0], pdf_name), pdf_path)
+        else:
+            jobs = max(1, min(args.jobs, args.generations))
+            workspaces = prepare_workspaces(document_path, filename, jobs, not args.no_format, not args.no_cache)
+            if args.optimize:
+                sampler = optimizer_sampler(args.maxpages, batch_size=jobs, patience=args.patience,
+                                            verbose=args.verbose)
+            elif args.sampling == "active":
+                sampler = active_learning_sampler(args.maxpages, verbose=args.verbose)
+            else:
+                sampler = batch_sampler(args.sampling)
+
+            def generate(configs):
+                return generate_rows(configs, filename, workspaces, source_hash=source_hash,
+                                     measure_only=args.measure_only, timings=args.timings)
+
+            # Create the output directory
+            create_dir(args.output)
+            # Each row is written to the result file as soon as its PDF is measured
+            result_path = os.path.join(args.output, "result." + args.format)
+            rows = []
+            with open_result_sink(result_path, conf_source, timings=args.timings) as write_row:
+                for i, row in enumerate(sampler(conf_source, args.generations, fixed_values, generate)):
+                    write_row(row)
+                    if args.optimize:
+                        rows.append(row)
+                    if args.verbose:
+                        print(f"Doc {i} generated")
 
-    # Clean working directory
-    shutil.rmtree(temp_path)
-    # Create the output directory
-    create_dir(args.output)
-    # Export results to CSV
-    result_path = os.path.join(args.output, "result.csv")
-    df.to_csv(result_path)
+            if args.optimize:
+                # Only the rows read from the cache were not compiled, the failed ones were
+                compilations = sum(1 for row in rows if row.get("nbPasses") != 0)
+                best = best_row(rows, args.maxpages)
+                if best is None:
+                    print(f"No config fits in {args.maxpages} pages after {compilations} compilations")
+                else:
+                    config = {name: value for name, value in best.items() if name not in RESULT_COLUMNS}
+                    pdf_name = filename + ".pdf"
+                    # The search may only have measured the documents
+                    row = generate_pdf(config, filename, workspaces[0], source_hash, cache_pdf=True)
+                    if row["nbPasses"] != 0:
+                        compilations += 1
+                    if row.get("failure"):
+                        print("The best document could not be built again :", row["failure"])
+                    else:
+                        shutil.copyfile(os.path.join(workspaces[0], pdf_name), os.path.join(args.output, pdf_name))
+                    optimum = {
+                        "config": config,
+                        "nbPages": row["nbPages"],
+                        "space": row["space"],
+                        "compilations": compilations
+                    }
+                    with open(os.path.join(args.output, "optimum.json"), 'w') as f:
+                        json.dump(optimum, f, indent=4)
+                    print(json.dumps(optimum, indent=4))
+    finally:
+        # Clean working directories, even if the generation failed
+        for path in workspaces:
+            shutil.rmtree(path)
 
     # ----------------------------------------
     # Decision Tree Analysis
     # ----------------------------------------
-    if args.config:
-        exit()  # Not useful for single generation
+    if args.config or args.optimize:
+        exit()  # Not useful for single generation, and the rows of the optimizer are not a random sample
     # Percentage of the sample used to create the tree
     # When using the tool we could use 100% of the data as we want the tree to be as precise as possible
     perc = args.trainsize
@@ -0,0 +1,11 @@
+from vary.model.generation.cache import bbl_key
+
+
+def test_bbl_key_follows_a_database_named_with_its_extension(tmp_path):
+    (tmp_path / "main.aux").write_text("\\citation{a}\n\\bibstyle{plain}\n\\bibdata{refs.bib}\n")
+    bib_path = tmp_path / "refs.bib"
+    bib_path.write_text("@misc{a, title={First}}\n")
+    key = bbl_key(str(tmp_path))
+
+    bib_path.write_text("@misc{a, title={Second}}\n")
+    assert bbl_key(str(tmp_path)) != key
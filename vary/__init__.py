@@ -1,5 +1,6 @@
 from flask import Flask
-from vary.model.files.directory import create_dir, get_secret_key
+from vary.model.files.directory import create_dir, get_secret_key, set_build_root
+from vary.model.scheduler import set_max_workers
 import os
 
 # Constants
@@ -14,8 +15,37 @@ app = Flask(__name__)
 # Config
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 8 * 1024 * 1024
+# Amount of PDFs compiled in parallel by the server
+app.config['COMPILE_JOBS'] = 1
+# Reuses the results of the configs already compiled for the same sources
+app.config['COMPILE_CACHE'] = True
+# Loads the static part of the preambles from a precompiled format
+app.config['PRECOMPILE_PREAMBLE'] = True
+# The sampled documents are only measured, as their PDF is never used
+app.config['MEASURE_ONLY'] = True
+# How the sampled configs are chosen : "random", "lhs", "pairwise" or "exhaustive" (see sample_configs)
+app.config['SAMPLING'] = "random"
+# Model of /predict : a "classifier" trained for each page limit, or a "regression" tree of the number of pages and
+# the remaining space, trained once for all the page limits
+app.config['PREDICTION_MODEL'] = "classifier"
+# Records the time spent in the stages of the generation and in the routes once the server handles requests,
+# exposed on /metrics
+app.config['METRICS'] = True
+# Adds the time spent in the stages of each generation to the result file
+app.config['TIMING_COLUMNS'] = False
+# Keeps the working directory of /build_pdf between the requests, until the sources change
+app.config['REUSE_WORKSPACES'] = True
+# Excludes the variables that the document never reads from the sampling and the results
+app.config['PRUNE_UNUSED_VARIABLES'] = False
+# Address of the Overleaf server of /import_overleaf
+app.config['OVERLEAF_URL'] = "https://www.overleaf.com"
+# Folder of the working directories of the builds, a tmpfs such as "/dev/shm/vary" keeps them in memory
+app.config['BUILD_ROOT'] = os.path.join("vary", "build")
 app.secret_key = get_secret_key(os.path.join("vary", "key"))
 
+set_max_workers(app.config['COMPILE_JOBS'])
+set_build_root(app.config['BUILD_ROOT'])
+
 # Creates the result folder as an empty folder is not saved by GIT
 create_dir(RESULT_FOLDER)
 
@@ -3,3 +3,4 @@ from pathlib import Path
 Path("vary/build").mkdir(parents=True, exist_ok=True)
 Path("vary/source").mkdir(parents=True, exist_ok=True)
 Path("vary/results").mkdir(parents=True, exist_ok=True)
+Path("vary/cache").mkdir(parents=True, exist_ok=True)
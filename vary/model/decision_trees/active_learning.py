@@ -0,0 +1,128 @@
+import pandas as pd
+
+from vary.model.generation.generate import random_config
+from vary.model.decision_trees.analysis import refine_csv, create_dt
+
+
+def encode_configs(df, features):
+    """
+    Transforms a dataframe of configs (or rows) into the features used by a decision tree, with the same
+    one-hot encoding as the training data. The categorical values that are not in features are dropped.
+    """
+    refined, _ = refine_csv(df)
+    return refined.reindex(columns=features, fill_value=0)
+
+
+def fit_classifier(rows, max_pages):
+    """
+    Trains a decision tree on the rows, to predict if a config fits in max_pages.
+    Returns the classifier and the array of the feature names.
+    """
+    df = pd.DataFrame(rows)
+    df, features = refine_csv(df)
+    y = (df["nbPages"] <= max_pages) & (df["space"] >= 0)
+    classifier = create_dt(df[features], y, len(df), min_samples_split=4)
+    return classifier, features
+
+
+def predict_fit_probability(classifier, features, configs):
+    """
+    Gives the probability of each config to fit in the page limit, according to the classifier.
+    """
+    classes = list(classifier.classes_)
+    if True not in classes:
+        return [0.0] * len(configs)
+    x = encode_configs(pd.DataFrame(configs), features)
+    return classifier.predict_proba(x)[:, classes.index(True)]
+
+
+def accuracy(classifier, features, rows, max_pages):
+    df = pd.DataFrame(rows)
+    y = (df["nbPages"] <= max_pages) & (df["space"] >= 0)
+    return classifier.score(encode_configs(df, features), y)
+
+
+def _config_key(config):
+    return tuple(sorted((k, str(v)) for k, v in config.items()))
+
+
+def active_learning_sampler(max_pages, batch_size=10, pool_factor=20, holdout_ratio=0.2, patience=3,
+                            tolerance=0.005, verbose=False):
+    """
+    Creates a sampler for generate_pdfs that spends the compilations near the page limit decision boundary.
+    A random sample is first built, part of it (holdout_ratio) being kept to measure the accuracy.
+    Then, in rounds, a decision tree is trained on the rows built so far, and the batch_size configs it is the
+    least sure about are built, among batch_size * pool_factor random candidates.
+    The sampling stops when nb_gens configs have been built, or when the accuracy did not improve by more than
+    tolerance for patience rounds.
+    """
+    def sampler(conf_source, nb_gens, fixed_values, generate):
+        yield from _active_learning_rows(
+            conf_source, nb_gens, fixed_values, generate, max_pages, batch_size, pool_factor, holdout_ratio,
+            patience, tolerance, verbose
+        )
+    return sampler
+
+
+def _active_learning_rows(conf_source, nb_gens, fixed_values, generate, max_pages, batch_size, pool_factor,
+                          holdout_ratio, patience, tolerance, verbose):
+    built = set()
+    holdout = []
+    train = []
+
+    def build(configs):
+        built.update(_config_key(config) for config in configs)
+        return generate(configs)
+
+    if nb_gens <= 0:
+        return
+    # Random rows used to measure the accuracy, and first training rows
+    holdout_size = min(nb_gens, max(1, int(nb_gens * holdout_ratio)))
+    initial_size = max(0, min(batch_size, nb_gens - holdout_size))
+    for row in build([random_config(conf_source, fixed_values) for _ in range(holdout_size)]):
+        if row.get("nbPages") is not None:
+            holdout.append(row)
+        yield row
+    for row in build([random_config(conf_source, fixed_values) for _ in range(initial_size)]):
+        if row.get("nbPages") is not None:
+            train.append(row)
+        yield row
+
+    remaining = nb_gens - holdout_size - initial_size
+    best_accuracy = None
+    rounds_without_improvement = 0
+    round_index = 0
+    while remaining > 0 and train:
+        classifier, features = fit_classifier(train, max_pages)
+        if holdout:
+            round_accuracy = accuracy(classifier, features, holdout, max_pages)
+            if verbose:
+                print(f"Round {round_index} : {len(train)} training rows, accuracy {round_accuracy}")
+            if best_accuracy is not None and round_accuracy <= best_accuracy + tolerance:
+                rounds_without_improvement += 1
+                if rounds_without_improvement >= patience:
+                    break
+            else:
+                rounds_without_improvement = 0
+            best_accuracy = round_accuracy if best_accuracy is None else max(best_accuracy, round_accuracy)
+
+        # Candidates that have not been built yet, the most uncertain ones are built
+        candidates = {}
+        for _ in range(batch_size * pool_factor):
+            config = random_config(conf_source, fixed_values)
+            key = _config_key(config)
+            if key not in built:
+                candidates[key] = config
+        if not candidates:
+            break
+        candidates = list(candidates.values())
+        probabilities = predict_fit_probability(classifier, features, candidates)
+        ranking = sorted(range(len(candidates)), key=lambda i: abs(probabilities[i] - 0.5))
+        batch = [candidates[i] for i in ranking[:min(batch_size, remaining)]]
+
+        for row in build(batch):
+            if row.get("nbPages") is not None:
+                train.append(row)
+            yield row
+        remaining -= len(batch)
+        round_index += 1
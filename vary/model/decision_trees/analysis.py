@@ -7,37 +7,53 @@ import subprocess
 # Data manipulation imports
 from sklearn.tree import DecisionTreeClassifier, export_graphviz
 import pandas as pd
+import numpy as np
 
+from vary.model.files.results import RESULT_COLUMNS
 
-def visualize_tree(tree, feature_names, output_path):
+
+def visualize_tree(tree, feature_names, output_path, name="dt", formats=("png",)):
     """
-    Creates a PNG image of a decision tree and exports it in the folder specified bu output_path.
-    The name of the image is dt.png.
+    Creates an image of a decision tree in each of the formats (any output format of dot, such as "png" or "svg")
+    and exports them in the folder specified bu output_path.
+    The name of the images is dt.png by default.
+    Returns False if dot, ie graphviz, could not produce the images.
     """
-    dot_path = os.path.join(output_path, "dt.dot")
-    img_path = os.path.join(output_path, "dt.png")
+    dot_path = os.path.join(output_path, name + ".dot")
     with open(dot_path, 'w') as f:
         export_graphviz(tree, out_file=f,
                         feature_names=feature_names,
                         filled=True,
                         special_characters=True,
                         rounded=True,
-                        class_names=list(map(str, tree.classes_)))
-    command = ["dot", "-Tpng", dot_path, "-o", img_path]
-    try:
-        subprocess.check_call(command)
-    except subprocess.CalledProcessError:
-        exit("Could not run dot, ie graphviz, to "
-             "produce visualization")
+                        class_names=list(map(str, tree.classes_)) if hasattr(tree, "classes_") else None)
+    for image_format in formats:
+        img_path = os.path.join(output_path, name + "." + image_format)
+        command = ["dot", "-T" + image_format, dot_path, "-o", img_path]
+        try:
+            subprocess.check_call(command)
+        except (subprocess.CalledProcessError, OSError):
+            print("Could not run dot, ie graphviz, to produce visualization")
+            return False
+    return True
 
 
 def load_csv(csv_path):
     """
-    Creates a dataframe based on the CSV path
+    Creates a dataframe based on the CSV path, or on a Parquet file if the path has the ".parquet" extension
     """
+    if csv_path.endswith(".parquet"):
+        return pd.read_parquet(csv_path)
     return pd.read_csv(csv_path, index_col=0)
 
 
+def drop_failures(df):
+    """
+    Removes the rows of the documents that could not be built, which have no measures
+    """
+    return df.dropna(subset=["nbPages", "space"])
+
+
 def refine_csv(df):
     """
     Transforms the categorical values (typically strings) of the sets into integers that could
@@ -48,12 +64,12 @@ def refine_csv(df):
 
     # Change string (seen as objects) values to booleans
     for col_name, col_type in dict(df.dtypes).items():
-        if col_type == 'O':  # If this is a column of objects (true for strings)
+        if col_type == 'O' and col_name not in RESULT_COLUMNS:  # If this is a column of objects (true for strings)
             df = pd.concat([df, pd.get_dummies(df[col_name], prefix=col_name)], axis=1)
             cat_vals.add(col_name)
 
-    # Get all the features except the class (nbPages), the remaining space, and initial categorical features
-    features = list(set(df.columns) - set(["nbPages", "space"]) - cat_vals)
+    # Get all the features except the measured values (nbPages, remaining space...), and initial categorical features
+    features = list(set(df.columns) - set(RESULT_COLUMNS) - cat_vals)
 
     return df, features
 
@@ -85,7 +101,7 @@ def decision_tree(csv_path, max_pages, perc=100, output_path=None):
     """
     Returns the classifier and the array of the feature names
     """
-    df = load_csv(csv_path)
+    df = drop_failures(load_csv(csv_path))
     # Replace string values by booleans with one-hot method
     df, features = refine_csv(df)
     sample_size = get_sample_size(df, perc)
@@ -106,60 +122,118 @@ def decision_tree(csv_path, max_pages, perc=100, output_path=None):
 def predict(classifier, config, config_src, features):
     """
     Uses tre decision tree to estimate the probability of a config (which can have incomplete data)
-    to match the target class
+    to match the target class. See predict_all to estimate many configs at once.
+    """
+    return predict_all(compile_tree(classifier, features), [config], config_src)[0]
+
+
+def compile_tree(classifier, features):
+    """
+    Extracts once the arrays of a decision tree needed by predict_all : the feature index, threshold and children
+    of each node, the leaves in the order their populations are added, and the thresholds of every feature.
+    The populations can be replaced in the returned dictionary, with "value" and "target_index".
     """
     internal_tree = classifier.tree_
-    # Modify the config to adapt categorical values
-    newconfig = config.copy()
-
-    for name in config_src["enums"]:
-        val = config.get(name)
-        if val:
-            del newconfig[name]
-            for possible_value in config_src["enums"][name]:
-                temp_name = pd.get_dummies(possible_value, prefix=name).columns[0]
-                newconfig[temp_name] = 0
-            newname = pd.get_dummies(val, prefix=name).columns[0]
-            newconfig[newname] = 1
-            
-    # Go through the nodes and store the population for each class in the accumulator
-    def recurse(node_id, acc):
-        # End condition : leaf node
-        if internal_tree.children_right[node_id] == internal_tree.children_left[node_id]:
-            # Add the populations of the leaf to the accumulator
-            res = list(map(sum, zip(acc, list(internal_tree.value[node_id][0]))))
-            return res
-        # The feature used in this node
-        ft = features[internal_tree.feature[node_id]]
-        value = newconfig.get(ft)
-        # If the value is defined then follow the corresponding path, otherwise work on the populations
-        # on the two branches
-        if value is not None:
+    left = internal_tree.children_left
+    right = internal_tree.children_right
+    classes = list(getattr(classifier, "classes_", []))
+
+    # Leaves in depth-first order, the right branch first
+    leaves = []
+    stack = [0]
+    while stack:
+        node_id = stack.pop()
+        if left[node_id] == right[node_id]:
+            leaves.append(node_id)
+        else:
+            stack.append(left[node_id])
+            stack.append(right[node_id])
+
+    thresholds = {}
+    for i, n in enumerate(internal_tree.feature):
+        if n >= 0 and left[i] != right[i]:
+            thresholds.setdefault(features[n], []).append(internal_tree.threshold[i])
+
+    return {
+        "features": features,
+        "feature_index": {name: index for index, name in enumerate(features)},
+        "feature": internal_tree.feature,
+        "threshold": internal_tree.threshold,
+        "left": left,
+        "right": right,
+        "leaves": leaves,
+        "value": internal_tree.value[:, 0, :],
+        "target_index": classes.index(True) if True in classes else None,
+        "thresholds": thresholds
+    }
+
+
+def encode_queries(tree, configs, config_src):
+    """
+    Creates the matrix of the feature values of the configs (one row per config) as the tree reads them,
+    with NaN for the missing values.
+    """
+    feature_index = tree["feature_index"]
+    x = np.full((len(configs), len(feature_index)), np.nan)
+    for row, config in enumerate(configs):
+        newconfig = config.copy()
+        for name, possible_values in config_src["enums"].items():
+            val = config.get(name)
+            if val:
+                del newconfig[name]
+                for possible_value in possible_values:
+                    newconfig[f"{name}_{possible_value}"] = 0
+                newconfig[f"{name}_{val}"] = 1
+        for name, value in newconfig.items():
+            index = feature_index.get(name)
+            if index is None or value is None:
+                continue
             if value == "true":
                 value = 1
             if value == "false":
                 value = 0
-            if float(value) > internal_tree.threshold[node_id]:
-                return recurse(internal_tree.children_right[node_id], acc)
-            else:
-                return recurse(internal_tree.children_left[node_id], acc)
-        else:
-            new_acc = recurse(internal_tree.children_right[node_id], acc)
-            return recurse(internal_tree.children_left[node_id], new_acc)
-
-    pop = recurse(0, [0]*internal_tree.n_classes[0])
+            x[row, index] = float(value)
+    return x
 
-    total = sum(pop)
-    classes = list(classifier.classes_)
-    if True not in classes:
-        return 0
-    target_index = classes.index(True)
-    return pop[target_index] / total
 
-
-def eval_options(classifier, config, config_src, features):
+def predict_all(tree, configs, config_src):
+    """
+    Estimates the probability of many configs (which can have incomplete data) to match the target class at once,
+    with a tree from compile_tree.
+    The nodes are visited once for all the configs : a node is reached by a config if its parent is, and if
+    the value of the config leads to it or is missing.
+    """
+    if tree["target_index"] is None:
+        return [0] * len(configs)
+    x = encode_queries(tree, configs, config_src)
+    left, right = tree["left"], tree["right"]
+    reached = np.zeros((len(configs), len(left)), dtype=bool)
+    reached[:, 0] = True
+    # The children of a node always have a higher id in scikit-learn trees
+    for node_id in range(len(left)):
+        if left[node_id] == right[node_id]:
+            continue
+        values = x[:, tree["feature"][node_id]]
+        missing = np.isnan(values)
+        go_right = values > tree["threshold"][node_id]
+        reached[:, right[node_id]] = reached[:, node_id] & (missing | go_right)
+        reached[:, left[node_id]] = reached[:, node_id] & (missing | ~go_right)
+
+    # The populations are always added in the order of the leaves, so the results do not depend on the configs
+    value = tree["value"]
+    pop = np.zeros((len(configs), value.shape[1]))
+    for leaf in tree["leaves"]:
+        pop += reached[:, leaf, None] * value[leaf]
+    total = np.zeros(len(configs))
+    for class_index in range(value.shape[1]):
+        total = total + pop[:, class_index]
+    return (pop[:, tree["target_index"]] / total).tolist()
+
+
+def eval_options(classifier, config, config_src, features, tree=None):
     """
     For a given config, evaluates the probability for a config one change away to match the target class.
+    tree is the result of compile_tree for the classifier, which is created if it is not given.
     Returns a dictionary similar to a configuration source but with probabilities.
     Structure :
     {
@@ -201,9 +275,18 @@ def eval_options(classifier, config, config_src, features):
         }
     }
     """
-    prob_dict = {}
+    if tree is None:
+        tree = compile_tree(classifier, features)
+    # The configs are evaluated together at the end, each probability is then stored in its container
+    queries = []
     temp_cfg = config.copy()
 
+    def ask(container, key):
+        container[key] = None  # Keeps the order of the keys
+        queries.append((container, key, temp_cfg.copy()))
+
+    prob_dict = {}
+
     # enums
     enums = {}
     for name, values in config_src["enums"].items():
@@ -212,10 +295,10 @@ def eval_options(classifier, config, config_src, features):
 
         for val in values:
             temp_cfg[name] = val
-            probas[val] = predict(classifier, temp_cfg, config_src, features)
+            ask(probas, val)
         
         del temp_cfg[name]
-        enums[name]["default"] = predict(classifier, temp_cfg, config_src, features)
+        ask(enums[name], "default")
 
         if name in config:
             temp_cfg[name] = config[name]
@@ -229,10 +312,10 @@ def eval_options(classifier, config, config_src, features):
         probas = {}
         for val in [True, False]:
             temp_cfg[name] = val
-            probas[val] = predict(classifier, temp_cfg, config_src, features)
+            ask(probas, val)
         
         del temp_cfg[name]
-        probas["default"] = predict(classifier, temp_cfg, config_src, features)
+        ask(probas, "default")
 
         if name in config:
             temp_cfg[name] = config[name]
@@ -251,7 +334,7 @@ def eval_options(classifier, config, config_src, features):
                 selected_value = name
         for name in group:
             temp_cfg[name] = True
-            choices[name] = predict(classifier, temp_cfg, config_src, features)
+            ask(choices, name)
             del temp_cfg[name]
         if selected_value:
             temp_cfg[selected_value] = config[selected_value]
@@ -265,27 +348,25 @@ def eval_options(classifier, config, config_src, features):
         numbers[name] = {}
         min_bound, max_bound, _ = domain
         numbers[name]["limits"] = []
-        internal_tree = classifier.tree_
-        thresholds = \
-            [min_bound] + \
-            [internal_tree.threshold[i] for i, n in enumerate(internal_tree.feature) if n >= 0 and features[n] == name] + \
-            [max_bound]
+        thresholds = [min_bound] + tree["thresholds"].get(name, []) + [max_bound]
         thresholds.sort()
         
         for lower, upper in (zip(thresholds[:-1], thresholds[1:])):
             average = (lower + upper) / 2
             temp_cfg[name] = average
-            numbers[name]["limits"].append({
-                "lower": lower,
-                "upper": upper,
-                "prob": predict(classifier, temp_cfg, config_src, features)
-            })
+            limit = {"lower": lower, "upper": upper}
+            numbers[name]["limits"].append(limit)
+            ask(limit, "prob")
             del temp_cfg[name]
-            numbers[name]["default"] = predict(classifier, temp_cfg, config_src, features)
+        # The value is removed in the same state after every interval
+        ask(numbers[name], "default")
 
-            if name in config:
-                temp_cfg[name] = config[name]
+        if name in config:
+            temp_cfg[name] = config[name]
     prob_dict["numbers"] = numbers
 
-    return prob_dict
+    probabilities = predict_all(tree, [cfg for _, _, cfg in queries], config_src)
+    for (container, key, _), probability in zip(queries, probabilities):
+        container[key] = probability
 
+    return prob_dict
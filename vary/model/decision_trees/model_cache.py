@@ -0,0 +1,121 @@
+import io
+import os
+import threading
+
+from collections import OrderedDict
+
+import pandas as pd
+
+from vary.model.decision_trees.analysis import load_csv, drop_failures, refine_csv, split_frame, create_dt
+from vary.model.decision_trees.surrogate import fit_regression_tree
+
+# Amount of trained trees kept (one per result file and page limit, and one regression tree per result file)
+MODEL_CACHE_SIZE = 8
+
+_lock = threading.Lock()
+# Content of the result files read so far, by path
+_results = {}
+# Trained trees by (path, max_pages), max_pages being None for the regression trees, with the version of the
+# results they were trained on
+_models = OrderedDict()
+
+
+def load_results(csv_path):
+    """
+    Gets the dataframe of a result file and its version, which changes when rows are added.
+    Only the rows appended since the previous call are read, as the file grows while the PDFs are generated.
+    The file is read again entirely if it has been rewritten (new generation or new variables).
+    """
+    with _lock:
+        return _load_results(csv_path)
+
+
+def _load_results(csv_path):
+    entry = _results.get(csv_path)
+    if csv_path.endswith(".parquet"):
+        mtime = os.stat(csv_path).st_mtime_ns
+        if not entry or entry["mtime"] != mtime:
+            entry = {"df": load_csv(csv_path), "mtime": mtime, "reads": entry["reads"] + 1 if entry else 0}
+            _results[csv_path] = entry
+        return entry["df"], (entry["reads"], len(entry["df"]))
+
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        if entry and entry["header"] == header and _is_unchanged(f, entry):
+            f.seek(entry["offset"])
+            new_lines = f.read()
+            # A line being written is kept for the next call
+            new_lines = new_lines[:new_lines.rfind(b"\n") + 1]
+            if new_lines:
+                new_rows = pd.read_csv(io.BytesIO(header + new_lines), index_col=0)
+                entry["df"] = pd.concat([entry["df"], new_rows])
+                entry["offset"] += len(new_lines)
+                entry["last_line"] = new_lines[new_lines.rfind(b"\n", 0, -1) + 1:]
+        else:
+            f.seek(len(header))
+            content = header + f.read()
+            content = content[:content.rfind(b"\n") + 1]
+            entry = {
+                "df": pd.read_csv(io.BytesIO(content), index_col=0),
+                "header": header,
+                "offset": len(content),
+                "last_line": content[content.rfind(b"\n", 0, -1) + 1:],
+                "reads": entry["reads"] + 1 if entry else 0
+            }
+            _results[csv_path] = entry
+    return entry["df"], (entry["reads"], len(entry["df"]))
+
+
+def _is_unchanged(f, entry):
+    """
+    Checks that the lines read before are still there, by comparing the last one.
+    """
+    start = entry["offset"] - len(entry["last_line"])
+    f.seek(start)
+    return f.read(len(entry["last_line"])) == entry["last_line"]
+
+
+def get_decision_tree(csv_path, max_pages):
+    """
+    Gets a decision tree trained on all the rows of the result file, like decision_tree, along with the version of
+    the results it was trained on.
+    The tree is only trained again when rows have been added to the results since the previous call.
+    Returns the classifier, the array of the feature names and the version.
+    """
+    def train(df):
+        df, features = refine_csv(drop_failures(df))
+        train, _, y = split_frame(df, features, len(df), max_pages)
+        return create_dt(train, y, len(df), min_samples_split=4), features
+
+    (classifier, features), version = _get_model((csv_path, max_pages), csv_path, train)
+    return classifier, features, version
+
+
+def get_regression_tree(csv_path):
+    """
+    Gets the regression tree of fit_regression_tree trained on all the rows of the result file, which answers
+    every page limit, along with the version of the results it was trained on.
+    """
+    return _get_model((csv_path, None), csv_path, fit_regression_tree)
+
+
+def _get_model(key, csv_path, train):
+    """
+    Gets the model stored with key if it has been trained on the current version of the results, or trains it
+    with train, a function of the dataframe of the results.
+    """
+    df, version = load_results(csv_path)
+    with _lock:
+        cached = _models.get(key)
+        if cached and cached[1] == version:
+            _models.move_to_end(key)
+            return cached
+
+    model = train(df)
+
+    with _lock:
+        _models[key] = (model, version)
+        _models.move_to_end(key)
+        while len(_models) > MODEL_CACHE_SIZE:
+            _models.popitem(last=False)
+    return model, version
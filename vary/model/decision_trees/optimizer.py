@@ -0,0 +1,126 @@
+import pandas as pd
+import numpy as np
+
+from sklearn.ensemble import RandomForestRegressor
+
+from vary.model.generation.sampling import sample_configs
+from vary.model.decision_trees.analysis import refine_csv
+from vary.model.decision_trees.active_learning import encode_configs, _config_key
+
+
+def fits(row, max_pages):
+    """
+    Tells if a built document meets the page limit, like the target class of the decision trees.
+    """
+    return row.get("nbPages") is not None and row["nbPages"] <= max_pages and row["space"] >= 0
+
+
+def leftover(row, max_pages):
+    """
+    Sorting key of the documents that fit : the fewer missing pages and the less space left on the last page,
+    the better the page limit is used.
+    """
+    return max_pages - row["nbPages"], row["space"]
+
+
+def best_row(rows, max_pages):
+    """
+    Gets the row of the document that fits in max_pages with the least leftover space, or None if none fits.
+    """
+    fitting = [row for row in rows if fits(row, max_pages)]
+    return min(fitting, key=lambda row: leftover(row, max_pages)) if fitting else None
+
+
+def fit_surrogate(rows, random_state=99):
+    """
+    Trains a random forest that predicts the number of pages and the remaining space of a config.
+    Returns the model and the array of the feature names.
+    """
+    df, features = refine_csv(pd.DataFrame(rows))
+    model = RandomForestRegressor(n_estimators=50, min_samples_leaf=2, random_state=random_state)
+    model.fit(df[features].astype(float), df[["nbPages", "space"]])
+    return model, features
+
+
+def score_candidates(model, features, configs, max_pages):
+    """
+    Estimates, for each config, the probability to fit in max_pages (the share of the trees of the forest that
+    predict it fits), the expected leftover space on the last page when it fits, and the average predicted number
+    of pages and space.
+    """
+    x = encode_configs(pd.DataFrame(configs), features).astype(float).values
+    # One prediction of (nbPages, space) per tree and per config
+    predictions = np.stack([tree.predict(x) for tree in model.estimators_])
+    fitting = (predictions[:, :, 0] <= max_pages + 0.5) & (predictions[:, :, 1] >= 0)
+    probability = fitting.mean(axis=0)
+    space = np.where(fitting, predictions[:, :, 1], 0).sum(axis=0) / np.maximum(fitting.sum(axis=0), 1)
+    pages_mean, space_mean = predictions.mean(axis=0).T
+    return probability, space, pages_mean, space_mean
+
+
+def rank_candidates(probability, space, pages_mean, space_mean):
+    """
+    Orders the candidates : the most likely to fit first, then the tightest. When no candidate is expected to fit,
+    the ones predicted to be the shortest come first, as they are the closest to the page limit.
+    """
+    if probability.max() > 0:
+        return np.lexsort((space, -probability))
+    return np.lexsort((-space_mean, pages_mean))
+
+
+def optimizer_sampler(max_pages, initial_size=5, batch_size=1, pool_size=500, patience=0, verbose=False):
+    """
+    Creates a sampler for generate_pdfs that looks for a config fitting in max_pages with as few compilations as
+    possible, instead of exploring the space.
+    A Latin hypercube of initial_size configs is built first. Then, in rounds, a random forest is trained on the
+    rows built so far and the batch_size configs it finds the most likely to fit (with the least leftover space)
+    are built, among pool_size random candidates.
+    The sampling stops once a config fits, or after patience more configs without a tighter fit, or after nb_gens
+    configs. The fixed values are kept in every config.
+    """
+    def sampler(conf_source, nb_gens, fixed_values, generate):
+        yield from _optimizer_rows(
+            conf_source, nb_gens, fixed_values, generate, max_pages, initial_size, batch_size, pool_size, patience,
+            verbose
+        )
+    return sampler
+
+
+def _optimizer_rows(conf_source, nb_gens, fixed_values, generate, max_pages, initial_size, batch_size, pool_size,
+                    patience, verbose):
+    built = set()
+    rows = []
+    best = None
+    without_improvement = 0
+
+    def build(configs):
+        nonlocal best, without_improvement
+        built.update(_config_key(config) for config in configs)
+        for row in generate(configs):
+            if row.get("nbPages") is not None:
+                rows.append(row)
+            if fits(row, max_pages) and (best is None or leftover(row, max_pages) < leftover(best, max_pages)):
+                best = row
+                without_improvement = 0
+            elif best is not None:
+                without_improvement += 1
+            yield row
+
+    yield from build(sample_configs(conf_source, min(initial_size, nb_gens), "lhs", fixed_values))
+    remaining = nb_gens - len(built)
+
+    while remaining > 0 and rows and (best is None or without_improvement < patience):
+        model, features = fit_surrogate(rows)
+        candidates = [
+            config for config in sample_configs(conf_source, pool_size, "random", fixed_values)
+            if _config_key(config) not in built
+        ]
+        if not candidates:
+            break
+        probability, space, pages_mean, space_mean = score_candidates(model, features, candidates, max_pages)
+        ranking = rank_candidates(probability, space, pages_mean, space_mean)
+        batch = [candidates[i] for i in ranking[:min(batch_size, remaining)]]
+        if verbose:
+            print(f"{len(built)} configs built, next one fits with a probability of {probability[ranking[0]]}")
+        yield from build(batch)
+        remaining -= len(batch)
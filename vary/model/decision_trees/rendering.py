@@ -0,0 +1,98 @@
+import os
+import glob
+import hashlib
+import threading
+
+from vary.model.files.directory import create_dir
+from vary.model.decision_trees.analysis import visualize_tree
+
+# Formats of the images of the trees
+RENDER_FORMATS = ("svg", "png")
+# Amount of rendered trees kept in a folder
+KEPT_RENDERS = 4
+
+_condition = threading.Condition()
+# Latest tree waiting to be rendered, by output folder
+_pending = {}
+# Key of the latest tree rendered in each output folder
+_rendered = {}
+_rendering = False
+_worker = None
+
+
+def render_key(classifier, features):
+    """
+    Creates the name of the images of a tree from its structure, so that an image is only rendered once for a tree,
+    even after a restart of the server.
+    """
+    internal_tree = classifier.tree_
+    sha = hashlib.sha1()
+    sha.update(repr(list(features)).encode())
+    sha.update(repr(list(getattr(classifier, "classes_", []))).encode())
+    for array in [internal_tree.children_left, internal_tree.children_right, internal_tree.feature,
+                  internal_tree.threshold, internal_tree.value]:
+        sha.update(array.tobytes())
+    return sha.hexdigest()[:16]
+
+
+def request_render(classifier, features, key, output_path):
+    """
+    Asks a background thread to render the tree in output_path, as <key>.svg and <key>.png, and returns
+    immediately. A tree that is already rendered is not rendered again, and only the latest request of a folder is
+    kept if the previous ones have not started yet.
+    """
+    global _worker
+    if os.path.isfile(os.path.join(output_path, key + "." + RENDER_FORMATS[-1])):
+        with _condition:
+            _rendered[output_path] = key
+            _pending.pop(output_path, None)
+        return
+    with _condition:
+        _pending[output_path] = (classifier, features, key)
+        if _worker is None:
+            _worker = threading.Thread(target=_render_loop, daemon=True)
+            _worker.start()
+        _condition.notify_all()
+
+
+def _render_loop():
+    global _rendering
+    while True:
+        with _condition:
+            _condition.wait_for(lambda: _pending)
+            output_path, (classifier, features, key) = _pending.popitem()
+            _rendering = True
+        create_dir(output_path)
+        success = visualize_tree(classifier, features, output_path, key, RENDER_FORMATS)
+        with _condition:
+            _rendering = False
+            if success:
+                _rendered[output_path] = key
+            _condition.notify_all()
+        if success:
+            _remove_old_renders(output_path)
+
+
+def _remove_old_renders(output_path):
+    paths = sorted(glob.glob(os.path.join(output_path, "*.dot")), key=os.path.getmtime, reverse=True)
+    for dot_path in paths[KEPT_RENDERS:]:
+        base_path = dot_path[:-len(".dot")]
+        for extension in ("dot",) + RENDER_FORMATS:
+            if os.path.isfile(base_path + "." + extension):
+                os.remove(base_path + "." + extension)
+
+
+def get_rendered(output_path, timeout=0):
+    """
+    Gets the key of the latest tree rendered in output_path, or None if no tree has been rendered.
+    If a tree is being rendered for this folder, waits for it at most timeout seconds.
+    The trees rendered before the server started are found from the files.
+    """
+    with _condition:
+        _condition.wait_for(lambda: output_path not in _pending and not _rendering, timeout)
+        if output_path in _rendered:
+            return _rendered[output_path]
+    paths = glob.glob(os.path.join(output_path, "*." + RENDER_FORMATS[-1]))
+    if not paths:
+        return None
+    return os.path.splitext(os.path.basename(max(paths, key=os.path.getmtime)))[0]
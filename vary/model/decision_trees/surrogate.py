@@ -0,0 +1,46 @@
+import numpy as np
+
+from sklearn.tree import DecisionTreeRegressor
+
+from vary.model.decision_trees.analysis import drop_failures, refine_csv, compile_tree, predict_all
+
+
+def fit_regression_tree(df, min_samples_split=4, random_state=99):
+    """
+    Trains a regression tree that predicts both the number of pages and the remaining space of the documents,
+    instead of a classifier for a given page limit, so a single tree answers any page limit (see feasibility_tree).
+    The measures of the training rows are kept with the leaf they fall in.
+    Returns a dictionary with the regressor and the array of the feature names.
+    """
+    df = drop_failures(df)
+    df, features = refine_csv(df)
+    regressor = DecisionTreeRegressor(min_samples_split=min_samples_split, random_state=random_state)
+    regressor.fit(df[features], df[["nbPages", "space"]])
+    return {
+        "regressor": regressor,
+        "features": features,
+        "tree": compile_tree(regressor, features),
+        "leaves": regressor.apply(df[features]),
+        "nbPages": df["nbPages"].values,
+        "space": df["space"].values
+    }
+
+
+def feasibility_tree(surrogate, max_pages):
+    """
+    Creates a tree for predict_all or eval_options where the populations of the leaves are the amount of training
+    documents of the leaf that do not fit and that fit in max_pages, so the probabilities are the ones of a
+    classifier with the same splits.
+    """
+    fit = (surrogate["nbPages"] <= max_pages) & (surrogate["space"] >= 0)
+    node_count = len(surrogate["tree"]["left"])
+    feasible = np.bincount(surrogate["leaves"], weights=fit, minlength=node_count)
+    infeasible = np.bincount(surrogate["leaves"], weights=~fit, minlength=node_count)
+    return dict(surrogate["tree"], value=np.column_stack([infeasible, feasible]), target_index=1)
+
+
+def feasibility_probabilities(surrogate, configs, config_src, max_pages):
+    """
+    Estimates the probability of each config (which can have incomplete data) to fit in max_pages.
+    """
+    return predict_all(feasibility_tree(surrogate, max_pages), configs, config_src)
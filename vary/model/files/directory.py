@@ -1,9 +1,25 @@
 import os
 import shutil
 import time
+import uuid
+import fnmatch
 
 from pathlib import Path
 
+# Helper macros injected in every working directory
+MACROS_PATH = os.path.join(os.path.split(os.path.realpath(__file__))[0], "../macros.tex")
+# Extensions of the files rewritten in the working directories, which are copied instead of being linked.
+# The outputs of LaTeX are copied too, as they share the name of a .tex file, and so are all the .aux files, which
+# pdflatex rewrites even when their .tex file is missing (such as values.aux in a cloned working directory)
+COPIED_EXTENSIONS = {".tex", ".txt", ".json", ".aux"}
+# Outputs of the LaTeX helpers that a build may rewrite in place, which are copied too : the conversions of epstopdf,
+# the files of the externalized TikZ figures (the figures themselves have a .md5 file) and the cache of minted
+GENERATED_PATTERNS = ["*-eps-converted-to.pdf", "*.md5", "*.dpth", "*/_minted-*/*"]
+
+# Folder of the working directories, see set_build_root
+_build_root = os.path.join("vary", "build")
+
+
 def clear_directory(path):
     """
     Removes the content of a directory without removing the directory itself
@@ -21,24 +37,68 @@ def remove_directory(path):
     shutil.rmtree(path)
 
 
+def set_build_root(path):
+    """
+    Sets the folder where the working directories are created. A folder on a tmpfs, such as /dev/shm/vary,
+    keeps the builds in memory.
+    """
+    global _build_root
+    _build_root = path
+
+
 def create_temporary_copy(path):
     """
     Creates a working directory with a copy of the project files, that can  be altered by the program
     and used for the compilations.
+    Only the files that may be rewritten are real copies : the .tex files, the outputs of LaTeX and of its helpers
+    (see GENERATED_PATTERNS) and the measures. The other files (figures, classes, bibliography...) are hard links
+    to the project files, or symbolic links when the build root is on another file system, so a working directory
+    costs almost no copy.
     """
+    # The random suffix keeps the copies unique when several workspaces are created at the same time
     timestamp = str(time.time())
-    tmp_path = os.path.join(os.getcwd(), "vary/build", timestamp)
+    tmp_path = os.path.join(os.getcwd(), _build_root, timestamp + "-" + uuid.uuid4().hex[:8])
     try:
-        shutil.copytree(path, tmp_path)
-        macro_path = os.path.join(os.path.split(os.path.realpath(__file__))[0], "../macros.tex")
+        shutil.copytree(path, tmp_path, copy_function=_copy_or_link)
         macro_copy_path = os.path.join(tmp_path, "macros.tex")
-        shutil.copyfile(macro_path, macro_copy_path)
+        if os.path.lexists(macro_copy_path):
+            os.remove(macro_copy_path)
+        _link(MACROS_PATH, macro_copy_path)
     except shutil.Error:
         print("Error creating the temporary copy")
 
     return tmp_path
 
 
+def _copy_or_link(src, dst):
+    extension = os.path.splitext(src)[1]
+    if extension in COPIED_EXTENSIONS or _is_generated(src):
+        return shutil.copy2(src, dst)
+    return _link(src, dst)
+
+
+def _is_generated(path):
+    """
+    Tells if a file is an output of LaTeX or of one of its helpers, which a build may rewrite in place.
+    """
+    base_path = os.path.splitext(path)[0]
+    # The outputs of LaTeX share the name of a .tex file, the externalized figures the name of their .md5 file
+    if os.path.isfile(base_path + ".tex") or os.path.isfile(base_path + ".md5"):
+        return True
+    return any(fnmatch.fnmatch(path, pattern) for pattern in GENERATED_PATTERNS)
+
+
+def _link(src, dst):
+    """
+    Links dst to the file src, which must never be written through the link.
+    """
+    try:
+        os.link(src, dst)  # Follows src if it is itself a link of another working directory
+    except OSError:
+        os.symlink(os.path.realpath(src), dst)
+    return dst
+
+
 def create_dir(path):
     """
     Creates a directory with the specified path if it does not already exists
@@ -0,0 +1,126 @@
+import os
+import re
+import hashlib
+import threading
+
+# Commands of the sources that the index and the injections rely on, with their optional arguments and their argument,
+# or the TeX form of \input, where the name of the file ends with a space
+TOKEN_PATTERN = re.compile(
+    r"\\(?:(documentclass|usepackage|RequirePackage|include|input|includegraphics|end)\s*((?:\[[^\]]*\])*)\s*"
+    r"\{([^}]*)}|(input)\s+([^\s{}\\%]+))"
+)
+# Start of a comment, a % that is not escaped
+COMMENT_PATTERN = re.compile(r"(?<!\\)%")
+# Numeric size of an \includegraphics command, with its unit
+GRAPHICS_PARAM_PATTERN = re.compile(r"(\w+)\s*=\s*([\d.]+)(.*)")
+# Macros of VaryLaTeX that read a variable, with the name of the variable
+USE_PATTERN = re.compile(r"\\(getVal|ifValElse|ifVal)\s*\{([^}]*)}")
+# Extensions of the sources that the index tokenizes
+SOURCE_EXTENSIONS = (".tex", ".sty", ".cls")
+
+_lock = threading.Lock()
+# Index of each project folder : the description of every file by path relative to the folder
+_indexes = {}
+
+
+def tokenize(lines):
+    """
+    Gets the code of each line, without its comment, and the commands of TOKEN_PATTERN found in it as
+    (line index, command, optional arguments without the brackets, argument, text of the command) tuples.
+    """
+    code = [COMMENT_PATTERN.split(line, 1)[0] for line in lines]
+    tokens = []
+    for index, line_code in enumerate(code):
+        for match in TOKEN_PATTERN.finditer(line_code):
+            if match.group(1):
+                tokens.append((index, match.group(1), match.group(2)[1:-1], match.group(3), match.group(0)))
+            else:
+                tokens.append((index, match.group(4), "", match.group(5), match.group(0)))
+    return code, tokens
+
+
+def included_files(tokens):
+    """
+    Gets the paths of the files included with \\input or \\include in the tokens of a file, relative to the folder
+    of the main file, where LaTeX looks for them, and of the packages and classes it loads, which are only files of
+    the project if they are local.
+    """
+    paths = []
+    for _, command, _, argument, _ in tokens:
+        if command in ("include", "input"):
+            name = os.path.normpath(argument.strip())
+            paths.append(name if name.endswith(".tex") else name + ".tex")
+        elif command in ("usepackage", "RequirePackage"):
+            paths += [name.strip() + ".sty" for name in argument.split(",") if name.strip()]
+        elif command == "documentclass":
+            paths.append(argument.strip() + ".cls")
+    return paths
+
+
+def update_index(folder):
+    """
+    Gets the index of a project folder, a dictionary with the path of every file relative to the folder as keys.
+    Each file is described by its SHA-256 "hash" and, for the sources (.tex, .sty and .cls files), by "includes" (the
+    files it includes or loads, see included_files) and "uses" (the (variable, macro) tuples of the VaryLaTeX macros
+    it calls). The .tex files are also described by "main" (if it declares a \\documentclass) and "graphics" (the
+    lines of the \\includegraphics commands with a numeric size).
+    Only the files that were added or modified since the previous call are read.
+    """
+    with _lock:
+        previous = _indexes.get(folder, {})
+        index = {}
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                # Not the ctime, which the hard links of the working directories change. The inode tells a file
+                # replaced by a rename (see sync_archive) that kept the size and modification time of the previous one
+                signature = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+                relative_path = os.path.relpath(path, folder)
+                entry = previous.get(relative_path)
+                index[relative_path] = entry if entry and entry["signature"] == signature \
+                    else _index_file(path, signature)
+        _indexes[folder] = index
+        return index
+
+
+def _index_file(path, signature):
+    with open(path, 'rb') as f:
+        content = f.read()
+    entry = {"signature": signature, "hash": hashlib.sha256(content).hexdigest()}
+    if path.endswith(SOURCE_EXTENSIONS):
+        code, tokens = tokenize(content.decode(errors="replace").splitlines())
+        entry["includes"] = included_files(tokens)
+        entry["uses"] = [(match.group(2).strip(), match.group(1))
+                         for line in code for match in USE_PATTERN.finditer(line)]
+    if path.endswith(".tex"):
+        entry["main"] = any(command == "documentclass" for _, command, _, _, _ in tokens)
+        entry["graphics"] = [index for index, command, options, _, _ in tokens
+                             if command == "includegraphics" and GRAPHICS_PARAM_PATTERN.match(options)]
+    return entry
+
+
+def reachable_files(folder, main_name):
+    """
+    Gets the sources of the document, relative to the folder : the main file, then the files it includes and the
+    local packages and classes it loads, recursively, in the order of the commands. The files that are not in the
+    project are left out.
+    """
+    index = update_index(folder)
+    files = []
+    pending = [main_name]
+    while pending:
+        name = pending.pop(0)
+        if name in files or name not in index:
+            continue
+        files.append(name)
+        pending += index[name].get("includes", [])
+    return files
+
+
+def get_main_files(folder):
+    """
+    Gets the paths, relative to the folder, of the .tex files that declare a \\documentclass.
+    """
+    return [path for path, entry in update_index(folder).items() if entry.get("main")]
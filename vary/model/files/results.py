@@ -0,0 +1,201 @@
+import os
+import csv
+
+from contextlib import contextmanager
+from pandas.core.common import flatten
+
+# Values measured on each PDF, stored after the variables in the results, with their types.
+# The measures of a PDF that could not be built are empty and "failure" gives the reason
+RESULT_TYPES = {
+    "nbPages": "int",
+    "space": "float",
+    "nbPasses": "int",
+    "failure": "str"
+}
+# Optional columns with the measures of the stages of the generation of each PDF, and the (stage, metric) they
+# come from (see metrics.collect_timings). The times are in seconds and the memory in bytes
+TIMING_COLUMNS = {
+    "generateWall": ("generate_pdf", "wall"),
+    "generateCpu": ("generate_pdf", "cpu"),
+    "compileWall": ("compile_latex", "wall"),
+    "compileCpu": ("compile_latex", "cpu"),
+    "compilePeakRss": ("compile_latex", "rss"),
+    "analysisWall": ("analyze_pdf", "wall")
+}
+TIMING_TYPES = {name: "int" if metric == "rss" else "float" for name, (_, metric) in TIMING_COLUMNS.items()}
+RESULT_COLUMNS = list(RESULT_TYPES) + list(TIMING_TYPES)
+
+# Amount of rows written at once in a Parquet row group
+PARQUET_BATCH_SIZE = 1000
+
+
+def result_columns(conf_source, timings=False):
+    """
+    Gets the columns of the results for a config source : one per variable, then the measured values.
+    """
+    return list(result_types(conf_source, timings))
+
+
+def result_types(conf_source, timings=False):
+    """
+    Gets an ordered dictionary with the columns of the results as the keys and their types as the values :
+    "bool", "int", "float" or "str". The timing columns are added if timings is set.
+    """
+    types = {}
+    for name in conf_source["booleans"]:
+        types[name] = "bool"
+    for name in conf_source["numbers"]:
+        types[name] = "float"
+    for name in conf_source["enums"]:
+        types[name] = "str"
+    for name in flatten(conf_source["choices"]):
+        types[name] = "bool"
+    types.update(RESULT_TYPES)
+    if timings:
+        types.update(TIMING_TYPES)
+    return types
+
+
+def timing_values(stage_timings):
+    """
+    Gets the values of the timing columns from the measures of collect_timings.
+    """
+    return {name: stage_timings.get(key) for name, key in TIMING_COLUMNS.items()}
+
+
+@contextmanager
+def open_result_sink(path, conf_source, reset=True, timings=False):
+    """
+    Opens a result file where the rows are written as soon as they are produced, so the memory used does not
+    depend on the amount of rows.
+    Yields a function that writes one row (a dictionary). The missing values are left empty.
+    The format depends on the extension of the path : CSV by default (the format of "result.csv"), or Parquet
+    for ".parquet" files, which keeps the types of the columns but needs pyarrow.
+    The rows of a CSV file survive a crash as soon as they are written. A Parquet file is only readable once it is
+    closed, so it is written next to the path and only replaces the previous file then : a crash loses the new
+    rows but leaves the previous file intact.
+    If reset is set to False and the file exists, the rows are appended to the previous ones.
+    If timings is set, the file has the timing columns.
+    """
+    types = result_types(conf_source, timings)
+    if path.endswith(".parquet"):
+        sink = _parquet_sink(path, types, reset)
+    else:
+        sink = _csv_sink(path, list(types), reset)
+    with sink as write_row:
+        yield write_row
+
+
+def _read_csv_header(path):
+    with open(path, newline='') as f:
+        header = next(csv.reader(f), [])
+        nb_rows = sum(1 for _ in f)
+    return header[1:], nb_rows
+
+
+@contextmanager
+def _csv_sink(path, columns, reset):
+    index = 0
+    if not reset and os.path.isfile(path):
+        previous_columns, index = _read_csv_header(path)
+        new_columns = [c for c in columns if c not in previous_columns]
+        columns = previous_columns + new_columns
+        if new_columns:
+            _add_csv_columns(path, columns)
+
+    with open(path, 'w' if index == 0 else 'a', newline='') as f:
+        writer = csv.writer(f)
+        if index == 0:
+            writer.writerow([""] + columns)  # The first column is the index, like with DataFrame.to_csv
+
+        def write_row(row):
+            nonlocal index
+            writer.writerow([index] + [_csv_value(row.get(c)) for c in columns])
+            f.flush()
+            index += 1
+
+        yield write_row
+
+
+def _csv_value(value):
+    return "" if value is None else value
+
+
+def _add_csv_columns(path, columns):
+    """
+    Rewrites a CSV result file with additional empty columns, when the variables changed between two runs.
+    """
+    tmp_path = path + ".tmp"
+    with open(path, newline='') as src, open(tmp_path, 'w', newline='') as dst:
+        reader = csv.reader(src)
+        writer = csv.writer(dst)
+        header = next(reader)
+        writer.writerow([""] + columns)
+        for line in reader:
+            values = dict(zip(header[1:], line[1:]))
+            writer.writerow(line[:1] + [values.get(c, "") for c in columns])
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _parquet_sink(path, types, reset):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("pyarrow is required to write the results in the Parquet format")
+
+    arrow_types = {"bool": pa.bool_(), "int": pa.int64(), "float": pa.float64(), "str": pa.string()}
+    schema = pa.schema([(name, arrow_types[t]) for name, t in types.items()])
+    # Parquet files can not be appended to, so the previous rows are copied in a new file
+    previous = pq.ParquetFile(path) if not reset and os.path.isfile(path) else None
+    # The file has no footer, so it can not be read, until the writer is closed
+    out_path = path + ".tmp"
+    batch = []
+
+    try:
+        with pq.ParquetWriter(out_path, schema) as writer:
+            if previous:
+                for record_batch in previous.iter_batches(batch_size=PARQUET_BATCH_SIZE):
+                    table = pa.Table.from_batches([record_batch])
+                    writer.write_table(_conform_table(table, schema))
+
+            def flush():
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                batch.clear()
+
+            def write_row(row):
+                batch.append({name: _typed_value(row.get(name), types[name]) for name in types})
+                if len(batch) >= PARQUET_BATCH_SIZE:
+                    flush()
+
+            try:
+                yield write_row
+            finally:
+                if batch:
+                    flush()
+    finally:
+        # The rows written before an error are kept, the writer being closed
+        if os.path.isfile(out_path):
+            os.replace(out_path, path)
+
+
+def _conform_table(table, schema):
+    import pyarrow as pa
+    columns = [
+        table.column(f.name).cast(f.type) if f.name in table.column_names else pa.nulls(len(table), f.type)
+        for f in schema
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def _typed_value(value, value_type):
+    if value is None or value == "":
+        return None
+    if value_type == "bool":
+        return value in [True, "True", "true", 1]
+    if value_type == "int":
+        return int(value)
+    if value_type == "float":
+        return float(value)
+    return str(value)
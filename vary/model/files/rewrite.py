@@ -0,0 +1,78 @@
+import os
+
+from vary.model.files.project_index import tokenize, update_index, reachable_files
+
+
+def insert_before(edits, index, text):
+    edits.setdefault(index, {"before": [], "after": [], "replace": []})["before"].append(text)
+
+
+def insert_after(edits, index, text):
+    edits.setdefault(index, {"before": [], "after": [], "replace": []})["after"].append(text)
+
+
+def replace_in_line(edits, index, old, new):
+    edits.setdefault(index, {"before": [], "after": [], "replace": []})["replace"].append((old, new))
+
+
+def rewrite_file(path, injections, is_main, variables):
+    """
+    Reads and tokenizes a file once, lets every injection register its edits, then writes the file once if it
+    changed. Returns True if the file was written.
+    An injection is a (function, main_only, sites) tuple, see rewrite_project. The function is called with a
+    dictionary describing the file ("path", "lines", "code", "tokens" and "main"), the edits by line (see
+    insert_before, insert_after and replace_in_line) and the variables it creates, to fill. It must not edit a file
+    it already rewrote.
+    """
+    with open(path) as f:
+        lines = f.readlines()
+    code, tokens = tokenize(lines)
+    source = {"path": path, "lines": lines, "code": code, "tokens": tokens, "main": is_main}
+    edits = {}
+    for function, main_only, _ in injections:
+        if is_main or not main_only:
+            function(source, edits, variables)
+
+    if edits:
+        output = []
+        for index, line in enumerate(lines):
+            edit = edits.get(index)
+            if edit is None:
+                output.append(line)
+                continue
+            for old, new in edit["replace"]:
+                line = line.replace(old, new)
+            output += edit["before"] + [line] + edit["after"]
+        with open(path, 'w') as f:
+            f.writelines(output)
+    return bool(edits)
+
+
+def rewrite_project(main_file_path, injections):
+    """
+    Applies the injections to the main file and, if some of them are not only for the main file, to the files it
+    includes with \\input or \\include, recursively. Each file is read and written at most once.
+    The include graph comes from the project index (see reachable_files). sites is the field of the index that lists
+    what an injection rewrites in the included files, so the files where no injection has anything to rewrite are
+    not read. The index is updated with the files written.
+    Returns the variables created by the injections, as the "numbers" of a config source.
+    """
+    variables = {}
+    if all(main_only for _, main_only, _ in injections):
+        # The main file alone does not need the index, which the working directories do not have
+        if os.path.isfile(main_file_path):
+            rewrite_file(main_file_path, injections, True, variables)
+        return variables
+
+    base_path, main_name = os.path.split(main_file_path)
+    index = update_index(base_path)
+    written = False
+    for name in reachable_files(base_path, main_name):
+        is_main = name == main_name
+        if not any(sites is None or index[name].get(sites)
+                   for _, main_only, sites in injections if is_main or not main_only):
+            continue
+        written |= rewrite_file(os.path.join(base_path, name), injections, is_main, variables)
+    if written:
+        update_index(base_path)
+    return variables
@@ -1,32 +1,110 @@
 import os
-import re
 import math
 
-from vary.model.files.dictionnaries import merge_dicts, merge_configs
+from vary.model.files.dictionnaries import merge_configs
+from vary.model.files.project_index import GRAPHICS_PARAM_PATTERN
+from vary.model.files.rewrite import rewrite_project, insert_before, insert_after, replace_in_line
+
+# Code written before the end of the main file to measure the document
+SPACE_INDICATOR = \
+    "\\newwrite\\writeRemSpace\n"+\
+    "\\immediate\\openout\\writeRemSpace=space.txt\n"+\
+    "\\immediate\\write\\writeRemSpace{\\the\\dimexpr\\pagegoal-\\pagetotal-\\baselineskip\\relax}\n"+\
+    "\\immediate\\closeout\\writeRemSpace\n"+\
+    "\\newwrite\\writePageCount\n"+\
+    "\\AtEndDocument{\\clearpage\n"+\
+    "  \\immediate\\openout\\writePageCount=pages.txt\n"+\
+    "  \\immediate\\write\\writePageCount{\\ifdefined\\ReadonlyShipoutCounter\\the\\ReadonlyShipoutCounter"+\
+    "\\else\\the\\numexpr\\value{page}-1\\relax\\fi}\n"+\
+    "  \\immediate\\closeout\\writePageCount}\n"
+ITEMSEP_LINE = r"\setlength\itemsep{\getVal{itemsep}pt}"
+
+
+def space_indicator_injection(source, edits, variables):
+    """
+    Writes the space indicator before the \\end{document} of the main file.
+    """
+    if any(r"\openout\writeRemSpace" in line for line in source["code"]):
+        return
+    ends = [index for index, command, _, argument, _ in source["tokens"] if command == "end" and argument == "document"]
+    if ends:
+        insert_before(edits, ends[-1], SPACE_INDICATOR)
+
+
+def include_macros_injection(source, edits, variables):
+    """
+    Includes the VaryLaTeX macros and the values of the variables after the \\documentclass of the main file.
+    """
+    included = {argument.strip() for _, command, _, argument, _ in source["tokens"] if command in ("include", "input")}
+    to_inject = "".join(f"\\include{{{name}}}\n" for name in ["macros", "values"] if name not in included)
+    classes = [index for index, command, _, _, _ in source["tokens"] if command == "documentclass"]
+    if to_inject and classes:
+        insert_after(edits, classes[0], to_inject)
+
+
+def itemsep_injection(source, edits, variables):
+    """
+    Makes the space between the items of the lists a variable, after the values are included in the main file.
+    """
+    if any(ITEMSEP_LINE in line for line in source["code"]):
+        return
+    values = [index for index, command, _, argument, _ in source["tokens"]
+              if command in ("include", "input") and argument.strip() == "values"]
+    if not values:
+        # The values may be included in the same pass, after the \documentclass
+        values = [index for index, edit in edits.items() if any("\\include{values}" in text for text in edit["after"])]
+    if values:
+        insert_after(edits, values[0], ITEMSEP_LINE + "\n")
+        variables["itemsep"] = [-5, 5, 1]
+
+
+def graphics_injection(source, edits, variables):
+    """
+    Replaces the numeric size of the \\includegraphics commands by a variable, with a range around the size.
+    """
+    for index, command, options, argument, text in source["tokens"]:
+        param_match = GRAPHICS_PARAM_PATTERN.match(options) if command == "includegraphics" else None
+        if param_match:
+            param_name, param_default_val, param_unit = param_match.groups()
+            var_name = param_name+"_"+argument
+            variables[var_name] = float_variable_to_range(float(param_default_val))
+            replace_in_line(
+                edits, index, text,
+                fr"\includegraphics[{param_name}=\getVal{{{var_name}}}{param_unit}]{{{argument}}}"
+            )
+
+
+# Rewrites of the sources, applied in this order, with the function, whether it only applies to the main file and
+# the field of the project index that lists what it rewrites in the other files (see rewrite_project)
+INJECTIONS = {
+    "include_macros": (include_macros_injection, True, None),
+    "itemsep": (itemsep_injection, True, None),
+    "graphics": (graphics_injection, False, "graphics"),
+    "space_indicator": (space_indicator_injection, True, None)
+}
+
+
+def prepare_project(main_file_path, names):
+    """
+    Applies the injections of INJECTIONS with the given names to the project in a single pass over its files,
+    and adds the variables they create to the "variables.json" file next to the main file.
+    The injections are idempotent : running them again does not change the files.
+    """
+    variables = rewrite_project(main_file_path, [INJECTIONS[name] for name in INJECTIONS if name in names])
+    if variables:
+        config_path = os.path.join(os.path.dirname(main_file_path), "variables.json")
+        merge_configs(config_path, {"numbers": variables})
+
 
 def inject_space_indicator(file_path):
     """
     Adds a command to the main .tex file to write the remaining space on the PDF at the end of the document.
     The result of the LaTeX command is an output in a file called "space.txt" with the space left.
-    The "space.txt" file is created during the PDF generation.
-    """
-    file_path_tex = file_path + ".tex"
-    to_inject = \
-        "\\newwrite\\writeRemSpace\n"+\
-        "\\immediate\\openout\\writeRemSpace=space.txt\n"+\
-        "\\immediate\\write\\writeRemSpace{\\the\\dimexpr\\pagegoal-\\pagetotal-\\baselineskip\\relax}\n"+\
-        "\\immediate\\closeout\\writeRemSpace\n"
-    pattern = re.compile(r"^[^%]*\\end{document}")
-    with open(file_path_tex, 'r+') as file:
-        lines = file.readlines()
-        doc_end_line = 0
-        for line in reversed(lines):
-            doc_end_line -= 1
-            if pattern.match(line):
-                break
-        lines.insert(doc_end_line, to_inject)
-        file.seek(0)  # Go back to the beginning of the file
-        file.writelines(lines)
+    It also writes the number of pages of the document in a file called "pages.txt", once the last floats
+    have been placed, so the documents can be measured without producing a PDF.
+    These files are created during the PDF generation.
+    """
+    rewrite_project(file_path + ".tex", [INJECTIONS["space_indicator"]])
 
 
 def get_remaining_space(path):
@@ -40,59 +118,14 @@ def get_remaining_space(path):
         return float(content[:-3])
 
 
-def get_sub_files(main_file_path):
-    """
-    Gets the list of the tex files included in the document
-    """
-    pattern = re.compile(r"^[^%]*\\(?:input|include)\{([^}]*)}")  # the "in" prefix is not excluded for readability
-    sub_files = []
-    with open(main_file_path, 'r') as f:
-        for line in f.readlines():
-            match = pattern.match(line)
-            if match:
-                sub_files.append(match.group(1))
-    return sub_files
-
-
-def add_graphics_variables_to_file(file_path):
-    """
-    Looks for all the 'includegraphics' commands in the file and extracts a variation point on the height/width/size.
-    Returns a dictionary with the name of the variables as the keys and their initial values as the values.
-    """
-    dir_path, filename = os.path.split(file_path)
-    if not filename.endswith(".tex"):
-        filename += ".tex"
-        file_path = os.path.join(dir_path, filename)
-
-    if not os.path.isfile(file_path):
-        return {}
-    
-
-    graphics_pattern = re.compile(r"^[^%]*(\\includegraphics\[([^\]]*)\]\{([^}]*)}).*")
-    param_pattern = re.compile(r"(\w+)\s*=\s*([\d.]+)(.*)")
-    variables = {}
-    with open(file_path, "r+") as f:
-        lines = f.readlines()
-        for i, line in enumerate(lines):
-            match = graphics_pattern.match(line)
-            if match:
-                param = match.group(2)
-                graphics_filename = match.group(3)
-                param_match = param_pattern.match(param)
-                if param_match:
-                    param_name = param_match.group(1)
-                    param_default_val = param_match.group(2)
-                    param_unit = param_match.group(3)
-                    var_name = param_name+"_"+graphics_filename
-                    variables[var_name] = float(param_default_val)
-                    newline = line.replace(
-                        match.group(1),
-                        fr"\includegraphics[{param_name}=\getVal{{{var_name}}}{param_unit}]{{{graphics_filename}}}"
-                    )
-                    lines[i] = newline
-        f.seek(0)
-        f.writelines(lines)
-    return variables
+def get_page_count(path):
+    """
+    Retrieves the number of pages of the document written during the build by the space indicator command,
+    in the "pages.txt" file.
+    """
+    page_count_file_path = os.path.join(path, "pages.txt")
+    with open(page_count_file_path) as f:
+        return int(f.read())
 
 
 def float_variable_to_range(variable):
@@ -109,57 +142,21 @@ def float_variable_to_range(variable):
 
 
 def add_graphics_variables(main_file_path):
-    base_path = os.path.dirname(main_file_path)
-    subfiles = [os.path.join(base_path, name) for name in get_sub_files(main_file_path)]
-    subfiles.append(main_file_path)
-    variables = {}
-    for file_path in subfiles:
-        set_values = add_graphics_variables_to_file(file_path)
-        variables = merge_dicts(variables, {k: float_variable_to_range(v) for k, v in set_values.items()})
-    config_path = os.path.join(base_path, "variables.json")
-    merge_configs(config_path, {"numbers": variables})
+    """
+    Makes the sizes of the images of the main file and of the files it includes variables.
+    """
+    prepare_project(main_file_path, ["graphics"])
 
 
 def add_include_macros_variables(main_file_path):
-    to_inject = ""
-    with open(main_file_path) as f:
-        content = f.read()
-        try:
-            content.index(r"\include{macros}")
-        except ValueError:
-            to_inject += "\\include{macros}\n"
-        try:
-            content.index(r"\include{values}")
-        except ValueError:
-            to_inject += "\\include{values}\n"
-
-    if to_inject:
-        documentclass_pattern = re.compile(r"\\documentclass(\[[^\]]*\])*{[^}]*}")
-        with open(main_file_path, "r+") as f:
-            lines = f.readlines()
-            for index, line in enumerate(lines):
-                match = documentclass_pattern.search(line)
-                if match:
-                    break
-            if match:
-                lines.insert(index + 1, to_inject)
-            f.seek(0)
-            f.writelines(lines)
+    """
+    Includes the macros and the values of the variables in the main file.
+    """
+    prepare_project(main_file_path, ["include_macros"])
 
 
 def add_itemsep_variable(main_file_path):
-    include_values_pattern = re.compile(r"\\include{values}")
-    with open(main_file_path, "r+") as f:
-        lines = f.readlines()
-        for index, line in enumerate(lines):
-            match = include_values_pattern.search(line)
-            if match:
-                break
-        if match:
-            lines.insert(index + 1, r"\setlength\itemsep{\getVal{itemsep}pt}")
-        f.seek(0)
-        f.writelines(lines)
-    itemsep_dict = {"numbers": {"itemsep": [-5, 5, 1]}}
-    base_path = os.path.dirname(main_file_path)
-    config_path = os.path.join(base_path, "variables.json")
-    merge_configs(config_path, itemsep_dict)
+    """
+    Makes the space between the items of the lists a variable.
+    """
+    prepare_project(main_file_path, ["itemsep"])
@@ -0,0 +1,69 @@
+import os
+
+from pandas.core.common import flatten
+
+from vary.model.files.project_index import update_index, reachable_files
+
+
+def analyze_variables(main_file_path, conf_source):
+    """
+    Finds where the variables of the config source are used, in the sources of the document given by the project
+    index (see reachable_files). Returns a dictionary with :
+    "uses", the (file, macro) tuples of each variable used in the document, the paths being relative to the folder
+    of the main file,
+    "unused", the variables that no file reads,
+    "unreachable", the variables only read in sources that the document never includes, with these files,
+    "dynamic", the names built from other macros or arguments (such as \\getVal{#1}), which could be any variable.
+    """
+    base_path, main_name = os.path.split(main_file_path)
+    index = update_index(base_path)
+    reachable = reachable_files(base_path, main_name)
+    uses = {}
+    dynamic = []
+    for path in reachable:
+        for name, macro in index[path]["uses"]:
+            if "\\" in name or "#" in name:
+                dynamic.append(name)
+            else:
+                uses.setdefault(name, []).append((path, macro))
+
+    # The sources of the project that are not part of the document
+    unreachable = {}
+    for path, entry in index.items():
+        if path not in reachable:
+            for variable, _ in entry.get("uses", []):
+                unreachable.setdefault(variable, set()).add(path)
+
+    variables = list(conf_source["booleans"]) + list(conf_source["numbers"]) + list(conf_source["enums"]) \
+        + list(flatten(conf_source["choices"]))
+    unused = [name for name in variables if name not in uses]
+    return {
+        "uses": {name: value for name, value in uses.items() if name in variables},
+        "unused": [name for name in unused if name not in unreachable],
+        "unreachable": {name: sorted(unreachable[name]) for name in unused if name in unreachable},
+        "dynamic": dynamic
+    }
+
+
+def get_dead_variables(analysis):
+    """
+    Gets the variables of an analysis that can not change the document : the unused and unreachable ones.
+    Nothing is dead if some names are dynamic, as they may read any variable.
+    """
+    if analysis["dynamic"]:
+        return set()
+    return set(analysis["unused"]) | set(analysis["unreachable"])
+
+
+def prune_variables(conf_source, dead):
+    """
+    Creates a config source without the dead variables, so they are neither sampled nor stored in the results.
+    A group of choices is only removed when none of its options is used, as choosing an unused option still
+    unsets the other ones.
+    """
+    pruned = dict(conf_source)
+    pruned["booleans"] = [name for name in conf_source["booleans"] if name not in dead]
+    pruned["numbers"] = {name: value for name, value in conf_source["numbers"].items() if name not in dead}
+    pruned["enums"] = {name: value for name, value in conf_source["enums"].items() if name not in dead}
+    pruned["choices"] = [options for options in conf_source["choices"] if any(o not in dead for o in options)]
+    return pruned
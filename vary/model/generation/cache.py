@@ -0,0 +1,180 @@
+import os
+import re
+import glob
+import json
+import shutil
+import hashlib
+import uuid
+
+from vary.model.files.directory import MACROS_PATH, create_dir
+from vary.model.files.project_index import update_index
+from vary.model.generation.inject import get_variable_def
+
+CACHE_FOLDER = os.path.join("vary", "cache", "compile")
+BBL_CACHE_FOLDER = os.path.join("vary", "cache", "bbl")
+# Size of the cache above which the least recently used entries are removed
+CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+RESULT_FILE_NAME = "result.json"
+PDF_FILE_NAME = "document.pdf"
+BBL_FILE_NAME = "references.bbl"
+
+# Lines of the .aux files read by bibtex
+BIBTEX_AUX_PATTERN = re.compile(r"^\\(?:citation|bibstyle|bibdata)\{.*$", re.MULTILINE)
+
+
+def _update_with_file(sha, file_path):
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+
+
+def hash_sources(path):
+    """
+    Computes a hash of the names and contents of all the files of a project, and of the VaryLaTeX macros.
+    Two source trees with the same hash produce the same documents for the same config.
+    The hashes of the files come from the project index, so only the files modified since the previous call are read.
+    """
+    sha = hashlib.sha256()
+    for relative_path, entry in update_index(path).items():  # In a deterministic walk order
+        sha.update(relative_path.encode() + b"\0" + entry["hash"].encode())
+    _update_with_file(sha, MACROS_PATH)
+    return sha.hexdigest()
+
+
+def config_key(source_hash, filename, config):
+    """
+    Creates the key of a compilation result.
+    The config is normalized through the macros written in "values.tex", so configs that produce
+    the same file share the same entry.
+    """
+    macros = sorted(m for m in (get_variable_def(k, v) for k, v in config.items()) if m)
+    content = "\n".join([source_hash, filename] + macros)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def load_result(key, pdf_dest=None):
+    """
+    Gets the values (number of pages, space left) stored for a key, or None if there is no entry.
+    If pdf_dest is set, the cached PDF is copied there, and an entry without a PDF counts as a miss.
+    """
+    entry_path = os.path.join(CACHE_FOLDER, key)
+    try:
+        with open(os.path.join(entry_path, RESULT_FILE_NAME)) as f:
+            result = json.load(f)
+        if pdf_dest:
+            shutil.copyfile(os.path.join(entry_path, PDF_FILE_NAME), pdf_dest)
+        os.utime(entry_path)  # Marks the entry as recently used
+    except (OSError, ValueError):
+        return None
+    return result
+
+
+def store_result(key, result, pdf_path=None):
+    """
+    Saves the values of a compilation, and optionally its PDF, then evicts old entries if the cache is too big.
+    """
+    create_dir(CACHE_FOLDER)
+    entry_path = os.path.join(CACHE_FOLDER, key)
+    # The entry is written in a temporary folder then renamed so other processes never see a partial entry
+    tmp_path = entry_path + "." + uuid.uuid4().hex + ".tmp"
+    os.mkdir(tmp_path)
+    with open(os.path.join(tmp_path, RESULT_FILE_NAME), 'w') as f:
+        json.dump(result, f)
+    if pdf_path:
+        shutil.copyfile(pdf_path, os.path.join(tmp_path, PDF_FILE_NAME))
+    shutil.rmtree(entry_path, ignore_errors=True)
+    try:
+        os.rename(tmp_path, entry_path)
+    except OSError:  # Another process stored the same entry in the meantime
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    evict()
+
+
+def bbl_key(working_directory):
+    """
+    Creates the key of the bibliography of a compiled document, from the lines of its .aux files that bibtex
+    reads (the citations, in their order, the style and the databases) and the contents of the .bib and .bst files
+    of the project that they reference. The files that are not in the project come from the TeX distribution and
+    only their names are used.
+    Returns None if the document has no bibliography database.
+    """
+    sha = hashlib.sha256()
+    databases = []
+    for aux_path in sorted(glob.glob(os.path.join(working_directory, "*.aux"))):
+        with open(aux_path, errors="replace") as f:
+            lines = BIBTEX_AUX_PATTERN.findall(f.read())
+        sha.update(os.path.basename(aux_path).encode() + b"\0" + "\n".join(lines).encode() + b"\0")
+        for line in lines:
+            command, _, names = line[1:].partition("{")
+            if command in ("bibdata", "bibstyle"):
+                extension = ".bib" if command == "bibdata" else ".bst"
+                # Like bibtex, the extension is only added when the name does not already have it
+                databases += [(command, name if name.endswith(extension) else name + extension)
+                              for name in (name.strip() for name in names.rstrip("}").split(","))]
+    if not any(command == "bibdata" for command, _ in databases):
+        return None
+    for _, name in databases:
+        path = os.path.join(working_directory, name)
+        sha.update(name.encode() + b"\0")
+        if os.path.isfile(path):
+            _update_with_file(sha, path)
+    return sha.hexdigest()
+
+
+def load_bbl(key, bbl_dest):
+    """
+    Copies the bibliography stored for a key to bbl_dest. Returns False if there is no entry.
+    """
+    entry_path = os.path.join(BBL_CACHE_FOLDER, key)
+    try:
+        shutil.copyfile(os.path.join(entry_path, BBL_FILE_NAME), bbl_dest)
+        os.utime(entry_path)  # Marks the entry as recently used
+    except OSError:
+        return False
+    return True
+
+
+def store_bbl(key, bbl_path):
+    """
+    Saves the bibliography generated by bibtex for a key.
+    """
+    create_dir(BBL_CACHE_FOLDER)
+    entry_path = os.path.join(BBL_CACHE_FOLDER, key)
+    tmp_path = entry_path + "." + uuid.uuid4().hex + ".tmp"
+    os.mkdir(tmp_path)
+    shutil.copyfile(bbl_path, os.path.join(tmp_path, BBL_FILE_NAME))
+    shutil.rmtree(entry_path, ignore_errors=True)
+    try:
+        os.rename(tmp_path, entry_path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    evict(folder=BBL_CACHE_FOLDER)
+
+
+def _entry_size(entry_path):
+    return sum(e.stat().st_size for e in os.scandir(entry_path) if e.is_file())
+
+
+def evict(max_size=CACHE_MAX_SIZE, folder=CACHE_FOLDER):
+    """
+    Removes the least recently used entries of a cache folder until it is smaller than max_size bytes.
+    """
+    entries = []
+    total_size = 0
+    for entry in os.scandir(folder):
+        if "." in entry.name:  # Entry being written
+            continue
+        try:
+            size = _entry_size(entry.path)
+            entries.append((entry.stat().st_mtime, size, entry.path))
+        except OSError:  # Removed by another process
+            continue
+        total_size += size
+
+    entries.sort()
+    for _, size, entry_path in entries:
+        if total_size <= max_size:
+            break
+        shutil.rmtree(entry_path, ignore_errors=True)
+        total_size -= size
@@ -1,32 +1,132 @@
 import os
+import re
+import glob
+import hashlib
+import time
 import subprocess
-from vary.model.generation.subcall import run_command
+from vary.model.generation.subcall import run_command, FatalError, TIMEOUT
+from vary.model.generation.cache import bbl_key, load_bbl, store_bbl
+from vary.model.metrics import timed
 
+# Upper bound of pdflatex runs for one document, in case the references never stabilize
+MAX_PASSES = 4
+# Files written during a run and read by the next one
+STATE_EXTENSIONS = [".toc", ".out", ".lof", ".lot"]
+RERUN_PATTERN = re.compile(r"Rerun to get|Label\(s\) may have changed|Please rerun|Rerun LaTeX")
+# The timeout of a pdflatex run is this factor times the duration of the baseline run of the project,
+# within the bounds below (in seconds)
+TIMEOUT_FACTOR = 4
+MIN_TIMEOUT = 5
+MAX_TIMEOUT = 120
+# File of the working directory where the timeout measured for the project is stored
+TIMEOUT_FILE = "timeout.txt"
 
-def generate_bbl(filepath):
+
+class CompilationError(Exception):
+    """
+    Raised when a document can not be compiled. The message is the reason : "timeout" or "fatal: <log line>".
+    """
+
+
+@timed("generate_bbl")
+def generate_bbl(filepath, use_cache=True):
     """
-    Loads the bibliography file
+    Loads the bibliography file.
+    The first pdflatex run is the baseline of the project : its duration sets the timeout of the next
+    compilations in this working directory (see get_timeout).
+    If use_cache is set, bibtex only runs when the citations or the bibliography files changed (see cache.bbl_key).
     """
     working_directory, texfile = os.path.split(filepath)
     
     try:
         # Precompile the main file to get the .aux file
-        run_command(["pdflatex", "-draftmode", "-interaction=batchmode", texfile + ".tex"], working_directory)
+        start = time.perf_counter()
+        run_command(["pdflatex", "-draftmode", "-interaction=batchmode", texfile + ".tex"], working_directory,
+                    timeout=MAX_TIMEOUT)
+        set_timeout(working_directory, time.perf_counter() - start)
+        key = bbl_key(working_directory) if use_cache else None
+        if key and load_bbl(key, filepath + ".bbl"):
+            return
         # Load the bibtex references from the .aux
         run_command(["bibtex", texfile + ".aux"], working_directory)
+        if key and os.path.isfile(filepath + ".bbl"):
+            store_bbl(key, filepath + ".bbl")
     except subprocess.TimeoutExpired:
         print("The bibliography compilation process timed out")
+    except FatalError as e:
+        print("The bibliography compilation process failed :", e)
+
+
+def set_timeout(working_directory, baseline):
+    """
+    Stores the timeout of the compilations of a working directory from the duration of a baseline run,
+    in seconds. The copies of the working directory keep it.
+    """
+    timeout = min(MAX_TIMEOUT, max(MIN_TIMEOUT, TIMEOUT_FACTOR * baseline))
+    with open(os.path.join(working_directory, TIMEOUT_FILE), 'w') as f:
+        f.write(str(round(timeout, 3)))
+
+
+def get_timeout(working_directory):
+    """
+    Gets the timeout of a pdflatex run in a working directory, or the default one if no baseline has been measured.
+    """
+    try:
+        with open(os.path.join(working_directory, TIMEOUT_FILE)) as f:
+            return float(f.read())
+    except (OSError, ValueError):
+        return TIMEOUT
+
+
+def get_state_hash(base_path):
+    """
+    Hashes the files that LaTeX reads back on the next run : the .aux files (including the ones of the
+    included files), the table of contents, the bookmarks and the lists of figures and tables.
+    """
+    working_directory = os.path.dirname(base_path)
+    paths = sorted(glob.glob(os.path.join(working_directory, "*.aux"))) + [base_path + e for e in STATE_EXTENSIONS]
+    sha = hashlib.sha1()
+    for path in paths:
+        if os.path.isfile(path):
+            sha.update(path.encode() + b"\0")
+            with open(path, 'rb') as f:
+                sha.update(f.read())
+    return sha.hexdigest()
 
 
-def compile_latex(filename):
+def needs_rerun(log_path):
+    """
+    Checks if LaTeX or a package asked for another run in the log.
+    """
+    if not os.path.isfile(log_path):
+        return False
+    with open(log_path, errors="replace") as f:
+        return any(RERUN_PATTERN.search(line) for line in f)
+
+
+@timed("compile_latex")
+def compile_latex(filename, draft=False):
     """
     Compile the document with pdftex.
-    After the generation of the bibliography we may need two runs to link all the references.
+    The document is compiled again only while the auxiliary files change or the log asks for a rerun, so
+    a variant that does not move any reference is built in a single pass.
+    If draft is set, every pass runs in draft mode and no PDF is written.
+    Each pass is stopped after the timeout of the working directory (see get_timeout), or as soon as the log
+    shows a fatal error, and a CompilationError gives the reason.
+    Returns the number of passes.
     """
     working_directory, texfile = os.path.split(filename)
+    base_path = os.path.splitext(filename)[0]
+    command = ["pdflatex"] + (["-draftmode"] if draft else []) + ["-interaction=batchmode", texfile]
+    timeout = get_timeout(working_directory)
     try:
-        run_command(["pdflatex", "-draftmode", "-interaction=batchmode", texfile], working_directory)
-        run_command(["pdflatex", "-interaction=batchmode", texfile], working_directory)
-        return True
+        for passes in range(1, MAX_PASSES + 1):
+            state = get_state_hash(base_path)
+            run_command(command, working_directory, timeout, base_path + ".log")
+            if get_state_hash(base_path) == state and not needs_rerun(base_path + ".log"):
+                break
+        return passes
     except subprocess.TimeoutExpired:
-        return False
+        raise CompilationError("timeout")
+    except FatalError as e:
+        raise CompilationError("fatal: " + str(e))
@@ -1,18 +1,24 @@
 import os
 import random
 import json
+import queue
+import multiprocessing
 
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 
-from pandas.core.common import flatten
 from pathlib import Path
 
 from vary.model.files.directory import create_temporary_copy, remove_directory
-from vary.model.files.tex_injection import inject_space_indicator, get_remaining_space
+from vary.model.files.results import open_result_sink, timing_values
+from vary.model.files.variable_usage import analyze_variables, get_dead_variables, prune_variables
+from vary.model.files.tex_injection import inject_space_indicator, get_remaining_space, get_page_count
 from vary.model.generation.compile import generate_bbl
 from vary.model.generation.inject import write_variables
-from vary.model.generation.compile import compile_latex
+from vary.model.generation.compile import compile_latex, CompilationError
 from vary.model.generation.analyze_pdf import page_count
+from vary.model.generation.cache import hash_sources, config_key, load_result, store_result
+from vary.model.generation.preamble import precompile_preamble
+from vary.model.metrics import timed, collect_timings
 
 
 def random_config(conf_source, fixed_values={}):
@@ -53,72 +59,280 @@ def random_config(conf_source, fixed_values={}):
     return config
 
 
-def generate_pdf(config, filename, temp_path):
+def random_sampler(conf_source, nb_gens, fixed_values, generate):
+    """
+    Default sampler of generate_pdfs : builds nb_gens random configs.
+    A sampler chooses the configs to build and yields the rows obtained with generate, a function that builds
+    an iterable of configs and returns an iterator over the rows.
+    """
+    return generate(random_config(conf_source, fixed_values) for _ in range(nb_gens))
+
+
+def load_cached_row(config, filename, source_hash, pdf_dest=None):
+    """
+    Gets the row of a config from the compilation cache, without building anything.
+    Returns None if the config has not been compiled for this version of the sources. If pdf_dest is set,
+    the PDF is copied there and a result cached without its PDF counts as a miss.
+    """
+    result = load_result(config_key(source_hash, filename, config), pdf_dest)
+    if result is None:
+        return None
+    row = config.copy()
+    row.update(result)
+    row["nbPasses"] = 0  # Nothing has been compiled
+    return row
+
+
+def generate_pdf(config, filename, temp_path, source_hash=None, cache_pdf=False, measure_only=False, timings=False):
     """
     Builds a PDF with the values defined in config. The bibliography should already be loaded.
-    Returns a dictionnary with the config and the calculated values of the PDF (number of pages, space left).
+    Returns a dictionnary with the config and the calculated values of the PDF (number of pages, space left)
+    along with the number of pdflatex passes it took.
+    If the document can not be built, the values of the PDF are None and the "failure" column gives the reason.
+    If source_hash (see cache.hash_sources) is set, the result is looked up in and saved to the compilation cache.
+    cache_pdf also stores the PDF, so that a cache hit still leaves the document in temp_path.
+    If measure_only is set, the document is only compiled in draft mode to measure it, and no PDF is written.
+    If timings is set, the measures of the stages of the generation are added to the row (see TIMING_COLUMNS).
     """
+    if not timings:
+        return _generate_pdf(config, filename, temp_path, source_hash, cache_pdf, measure_only)
+    with collect_timings() as stage_timings:
+        row = _generate_pdf(config, filename, temp_path, source_hash, cache_pdf, measure_only)
+    row.update(timing_values(stage_timings))
+    return row
+
+
+@timed("generate_pdf")
+def _generate_pdf(config, filename, temp_path, source_hash, cache_pdf, measure_only):
+    cache_pdf = cache_pdf and not measure_only
     filename_tex = filename + ".tex"
     filename_pdf = filename + ".pdf"
     tex_path = os.path.join(temp_path, filename_tex)
     pdf_path = os.path.join(temp_path, filename_pdf)
 
+    if source_hash:
+        row = load_cached_row(config, filename, source_hash, pdf_path if cache_pdf else None)
+        if row is not None:
+            return row
+
     write_variables(config, temp_path)
+    # The outputs of the previous variant must not be measured if this one is not built
+    for output_path in [pdf_path, os.path.join(temp_path, "pages.txt"), os.path.join(temp_path, "space.txt")]:
+        if os.path.isfile(output_path):
+            os.remove(output_path)
 
-    compile_latex(tex_path)
-    
     row = config.copy()
-    row["nbPages"] = page_count(pdf_path)
-    row["space"] = get_remaining_space(temp_path)
+    try:
+        passes = compile_latex(tex_path, draft=measure_only)
+    except CompilationError as e:
+        row.update({"nbPages": None, "space": None, "nbPasses": None, "failure": str(e)})
+        return row
+
+    try:
+        with timed("analyze_pdf"):
+            row["nbPages"] = get_page_count(temp_path) if measure_only else page_count(pdf_path)
+            row["space"] = get_remaining_space(temp_path)
+    except (OSError, RuntimeError, ValueError):
+        row.update({"nbPages": None, "space": None, "failure": "no output"})
+    row["nbPasses"] = passes
+    if row.get("failure"):
+        return row  # Failures are not cached, they are retried on the next generation
+
+    if source_hash:
+        result = {"nbPages": row["nbPages"], "space": row["space"]}
+        store_result(config_key(source_hash, filename, config), result, pdf_path if cache_pdf else None)
 
     return row
 
 
-def generate_random(conf_source, filename, temp_path, fixes_values={}):
+def generate_random(conf_source, filename, temp_path, fixes_values={}, **options):
     """
     Builds a PDF from a random config based on conf_source.
     Returns a dictionary with the config and the calculated values of the PDF (number of pages, space left).
+    The options are passed to generate_pdf.
     """
     config = random_config(conf_source, fixes_values)
-    return generate_pdf(config, filename, temp_path)
+    return generate_pdf(config, filename, temp_path, **options)
+
+
+def prepare_workspace(source, filename, precompile=True, use_cache=True):
+    """
+    Creates a working directory with a copy of the project, the space indicator injected in the main file and
+    the bibliography already generated. Returns the path of the working directory.
+    If precompile is set, the static part of the preamble is loaded from a precompiled format when possible.
+    If use_cache is set, the bibliography is read from the cache when bibtex already built it.
+    """
+    temp_path = create_temporary_copy(source)
+    file_path = os.path.join(temp_path, filename)
+    inject_space_indicator(file_path)
+    if precompile:
+        precompile_preamble(file_path)
+    generate_bbl(file_path, use_cache)  # LaTeX bbl pregeneration
+    return temp_path
+
+
+def prepare_workspaces(source, filename, count, precompile=True, use_cache=True):
+    """
+    Creates count independent working directories for the project.
+    Only the first one is prepared from the sources, the others are copies of it so the bibliography is
+    generated once.
+    """
+    first = prepare_workspace(source, filename, precompile, use_cache)
+    return [first] + [create_temporary_copy(first) for _ in range(count - 1)]
+
+
+# Working directory of the current worker process, see _init_worker
+_worker_workspace = None
+
 
+def _init_worker(workspaces):
+    """
+    Gives its own working directory to a worker process of the pool.
+    """
+    global _worker_workspace
+    _worker_workspace = workspaces.get()
+
+
+def _generate_in_worker(config, filename, options):
+    return generate_pdf(config, filename, _worker_workspace, **options)
+
+
+def _generate_in_free_workspace(config, filename, free_workspaces, options):
+    """
+    Builds a PDF in the first working directory that is not used by another task.
+    """
+    temp_path = free_workspaces.get()
+    try:
+        return generate_pdf(config, filename, temp_path, **options)
+    finally:
+        free_workspaces.put(temp_path)
+
+
+def _collect_rows(configs, submit_config, max_pending):
+    """
+    Submits the configs with submit_config, which returns a future, and yields the rows in completion order.
+    Only a few configs are submitted in advance so that configs can be a lazy iterator of any length.
+    """
+    pending = set()
+    try:
+        for config in configs:
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(submit_config(config))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        # Stops the remaining compilations if the caller does not consume every row
+        for future in pending:
+            future.cancel()
+
+
+def generate_rows(configs, filename, workspaces, submit=None, **options):
+    """
+    Builds a PDF for every config and yields the rows as soon as they are available.
+    With several working directories, the configs are compiled in a process pool with one worker per
+    directory, and the rows are yielded in completion order.
+    If submit is set, the compilations are given to it instead of the process pool : it is called with a
+    function and its arguments and returns a future, like the submit functions of the scheduler module.
+    The options are passed to generate_pdf.
+    """
+    if submit:
+        free_workspaces = queue.Queue()
+        for temp_path in workspaces:
+            free_workspaces.put(temp_path)
+        # A task is only submitted once the previous one freed its working directory, so it never holds a worker
+        # of the scheduler while waiting for a directory, which would delay the interactive builds
+        yield from _collect_rows(
+            configs,
+            lambda config: submit(_generate_in_free_workspace, config, filename, free_workspaces, options),
+            len(workspaces)
+        )
+        return
+
+    if len(workspaces) == 1:
+        for config in configs:
+            yield generate_pdf(config, filename, workspaces[0], **options)
+        return
+
+    worker_workspaces = multiprocessing.Queue()
+    for temp_path in workspaces:
+        worker_workspaces.put(temp_path)
+
+    with ProcessPoolExecutor(len(workspaces), initializer=_init_worker, initargs=(worker_workspaces,)) as executor:
+        yield from _collect_rows(
+            configs,
+            lambda config: executor.submit(_generate_in_worker, config, filename, options),
+            2 * len(workspaces)
+        )
 
-def generate_pdfs(filename, source, output, nb_gens, reset=True, fixed_values = {}):
+
+def prune_unused_variables(conf_source, main_file_path, verbose=True):
+    """
+    Removes the variables that the document never reads from the config source.
+    """
+    dead = get_dead_variables(analyze_variables(main_file_path, conf_source))
+    if dead and verbose:
+        print("Variables excluded as the document does not use them :", ", ".join(sorted(dead)))
+    return prune_variables(conf_source, dead)
+
+
+def generate_pdfs(filename, source, output, nb_gens, reset=True, fixed_values = {}, jobs=1, use_cache=True,
+                  precompile=True, measure_only=False, progress=None, cancel=None, submit=None,
+                  sampler=random_sampler, timings=False, prune_unused=False):
     """
     Creates as many PDFs as specified with nb_gens, from a random config based on conf_source, and calculate
     their values. The config and values are stored in a "result.csv" file in the output directory.
     If reset is set to False and there is already a result file, the results are appended to the previous ones.
+    jobs is the number of PDFs compiled in parallel, each one in its own working directory.
+    If use_cache is set, configs already compiled for the same sources are read from the compilation cache,
+    and so is the bibliography.
+    If precompile is set, the static part of the preamble is loaded from a precompiled format when possible.
+    If measure_only is set, the documents are only measured and no PDF is written.
+    progress is called with every row once it has been written, and the generation stops early when the
+    cancel event (a threading.Event) is set.
+    submit replaces the process pool to run the compilations, see generate_rows.
+    sampler chooses the configs that are built, see random_sampler.
+    If timings is set, the measures of the stages of each generation are added to the results.
+    If prune_unused is set, the variables that the document never reads are neither sampled nor stored in the
+    results (see variable_usage). The variables are not pruned when the results are appended to the previous
+    ones, whose columns they would leave empty.
     """
-    temp_path = create_temporary_copy(source)  # Create the temporary working directory
-    file_path = os.path.join(temp_path, filename)
-    inject_space_indicator(file_path)
-    generate_bbl(file_path)  # LaTeX bbl pregeneration
+    source_hash = hash_sources(source) if use_cache else None
+    workspaces = prepare_workspaces(source, filename, max(1, min(jobs, nb_gens)), precompile, use_cache)
 
     # Load the variables
     conf_source_path = os.path.join(source, "variables.json")
     with open(conf_source_path) as f:
         conf_source = json.load(f)
+    if prune_unused and reset:
+        conf_source = prune_unused_variables(conf_source, os.path.join(source, filename + ".tex"))
 
-    # DataFrame initialisation
-    csv_result_path = os.path.join(output, "result.csv")
-    df = _create_df(conf_source) if reset else pd.read_csv(csv_result_path, index_col=0)
-
-    for _ in range(nb_gens):
-        row = generate_random(conf_source, filename, temp_path, fixed_values)
-        df = df.append(row, ignore_index=True)
-
-    # Clean working directory
-    remove_directory(temp_path)
     # Create the output directory
     Path(output).mkdir(parents=True, exist_ok=True)
-    # Export results to CSV
-    df.to_csv(csv_result_path)
+    # Each row is written to the CSV as soon as its PDF is measured
+    csv_result_path = os.path.join(output, "result.csv")
 
+    def generate(configs):
+        return generate_rows(configs, filename, workspaces, submit, source_hash=source_hash, measure_only=measure_only,
+                             timings=timings)
 
-def _create_df(conf_source):
-    cols = conf_source["booleans"] \
-           + list(conf_source["numbers"].keys()) \
-           + list(conf_source["enums"].keys()) \
-           + list(flatten(conf_source["choices"])) \
-           + ["nbPages", "space"]
-    return pd.DataFrame(columns=cols)
+    try:
+        with open_result_sink(csv_result_path, conf_source, reset, timings) as write_row:
+            rows = sampler(conf_source, nb_gens, fixed_values, generate)
+            try:
+                for row in rows:
+                    write_row(row)
+                    if progress:
+                        progress(row)
+                    if cancel and cancel.is_set():
+                        break
+            finally:
+                rows.close()  # Stops the compilations that are still pending
+    finally:
+        # Clean working directories
+        for temp_path in workspaces:
+            remove_directory(temp_path)
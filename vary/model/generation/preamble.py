@@ -0,0 +1,244 @@
+import os
+import re
+import glob
+import shutil
+import hashlib
+import subprocess
+
+from vary.model.files.directory import create_dir
+from vary.model.files.project_index import COMMENT_PATTERN, USE_PATTERN, tokenize, included_files
+from vary.model.generation.subcall import run_command
+
+FORMAT_FOLDER = os.path.join("vary", "cache", "formats")
+FORMAT_NAME = "vary_preamble"
+
+# Local files that can be loaded by the preamble and change the format
+PREAMBLE_DEPENDENCIES = ["*.cls", "*.sty", "*.clo", "*.cfg", "*.def", "macros.tex"]
+# Commands that load the code kept in the format
+PACKAGE_PATTERN = re.compile(r"\\(?:documentclass|usepackage|RequirePackage)\b")
+# Inclusion of the values, which change for every variant
+VALUES_PATTERN = re.compile(r"\\(?:include|input)\s*\{values(?:\.tex)?}")
+BEGIN_DOCUMENT_PATTERN = re.compile(r"\\begin\s*\{document}")
+
+# Output of the --version option of the TeX programs, by program
+_versions = {}
+
+
+def get_version(program):
+    """
+    Gets the version of a TeX program, or an empty string if it is not installed.
+    """
+    if program not in _versions:
+        try:
+            _versions[program] = subprocess.run(
+                [program, "--version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            ).stdout.decode(errors="replace")
+        except OSError:
+            _versions[program] = ""
+    return _versions[program]
+
+
+def get_pdflatex_version():
+    """
+    Gets the version of pdflatex, as a format can only be loaded by the engine that dumped it.
+    """
+    return get_version("pdflatex")
+
+
+def split_preamble(lines):
+    """
+    Splits the main file in the static part of the preamble, dumped in the format, and the rest of the document.
+    The static part ends after the last package loaded before \\begin{document}, or before the first line that
+    reads a variable. The inclusion of the values is moved to the rest of the document, as they change for every
+    variant.
+    Returns the (static, dynamic) lists of lines, or None if the static part has no \\documentclass.
+    """
+    code = [COMMENT_PATTERN.split(line, 1)[0] for line in lines]
+    begin = next((index for index, line in enumerate(code) if BEGIN_DOCUMENT_PATTERN.search(line)), None)
+    if begin is None:
+        return None
+    end = 0
+    index = 0
+    while index < begin and not USE_PATTERN.search(code[index]):
+        if PACKAGE_PATTERN.search(code[index]):
+            command_end = _command_end(code, index, begin)
+            if any(USE_PATTERN.search(line) for line in code[index:command_end]):
+                break
+            end = index = command_end
+        else:
+            index += 1
+
+    values = [index for index in range(end) if VALUES_PATTERN.search(code[index])]
+    static = [line for index, line in enumerate(lines[:end]) if index not in values]
+    if not any("\\documentclass" in line for line in code[:end]):
+        return None
+    return static, [lines[index] for index in values] + lines[end:]
+
+
+def _command_end(code, index, limit):
+    """
+    Gets the index of the line after a command, whose arguments may span several lines.
+    """
+    depth = 0
+    for end in range(index, limit):
+        depth += code[end].count("{") + code[end].count("[") - code[end].count("}") - code[end].count("]")
+        if depth <= 0:
+            return end + 1
+    return limit
+
+
+def get_static_preamble(static):
+    """
+    Creates the content that is dumped in the format from the lines of the static part of the preamble.
+    The macros are loaded with \\input, as the auxiliary file opened by \\include can not be kept in a format.
+    """
+    static = "".join(static)
+    return re.sub(r"\\include\{macros(?:\.tex)?}", r"\\input{macros}", static)
+
+
+def get_package_files(static_preamble, working_directory):
+    """
+    Gets the paths where kpsewhich finds the packages and the class loaded by the static preamble, with their
+    modification times, so a format is dumped again when the TeX distribution updates them.
+    """
+    _, tokens = tokenize(static_preamble.splitlines())
+    names = [name for name in included_files(tokens) if name.endswith((".sty", ".cls"))]
+    if not names:
+        return ""
+    try:
+        paths = subprocess.run(
+            ["kpsewhich"] + names, cwd=working_directory, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        ).stdout.decode(errors="replace").splitlines()
+    except OSError:
+        return ""
+    return "\n".join(f"{path} {os.stat(os.path.join(working_directory, path)).st_mtime_ns}"
+                     for path in paths if os.path.isfile(os.path.join(working_directory, path)))
+
+
+def get_format_hash(static_preamble, working_directory):
+    sha = hashlib.sha256()
+    sha.update(get_pdflatex_version().encode())
+    sha.update(get_version("kpsewhich").encode())
+    sha.update(get_package_files(static_preamble, working_directory).encode())
+    sha.update(static_preamble.encode())
+    for pattern in PREAMBLE_DEPENDENCIES:
+        for path in sorted(glob.glob(os.path.join(working_directory, pattern))):
+            sha.update(os.path.basename(path).encode() + b"\0")
+            with open(path, 'rb') as f:
+                sha.update(f.read())
+    return sha.hexdigest()
+
+
+def _get_errors(log_path):
+    with open(log_path, errors="replace") as f:
+        return {line for line in f if line.startswith("!")}
+
+
+def dump_format(static_preamble, working_directory):
+    """
+    Dumps the static preamble in a format file in the working directory with the usual -ini / \\dump method.
+    Returns True if the format has been created.
+    """
+    with open(os.path.join(working_directory, FORMAT_NAME + ".tex"), 'w') as f:
+        f.write(static_preamble)
+        f.write("\\dump\n")
+    try:
+        run_command(
+            ["pdflatex", "-ini", "-interaction=batchmode", "-jobname=" + FORMAT_NAME, "&pdflatex", FORMAT_NAME + ".tex"],
+            working_directory
+        )
+    except subprocess.TimeoutExpired:
+        return False
+    return os.path.isfile(os.path.join(working_directory, FORMAT_NAME + ".fmt"))
+
+
+def get_compilation_errors(file_path):
+    """
+    Runs a draft compilation of the document and returns the set of the errors found in the log,
+    or None if the compilation did not produce any output.
+    """
+    working_directory, texfile = os.path.split(file_path)
+    for ext in [".aux", ".log"]:
+        if os.path.isfile(file_path + ext):
+            os.remove(file_path + ext)
+    try:
+        run_command(["pdflatex", "-draftmode", "-interaction=batchmode", texfile + ".tex"], working_directory)
+        return _get_errors(file_path + ".log") if os.path.isfile(file_path + ".aux") else None
+    except (subprocess.TimeoutExpired, OSError):
+        return None
+
+
+def check_format(file_path, lines, rewritten_lines):
+    """
+    Checks that the document compiles with the format : it must not have more errors than the original document.
+    The original document is only compiled if the rewritten one has errors.
+    """
+    errors = get_compilation_errors(file_path)
+    if errors is None:
+        return False
+    if not errors:
+        return True
+    _write_lines(file_path + ".tex", lines)
+    original_errors = get_compilation_errors(file_path)
+    _write_lines(file_path + ".tex", rewritten_lines)
+    return original_errors is not None and errors <= original_errors
+
+
+def precompile_preamble(file_path):
+    """
+    Replaces the static part of the preamble of the main file (see split_preamble) by a precompiled format, so that
+    the variants do not load the document class and the packages again.
+    The formats are kept in FORMAT_FOLDER and rebuilt when the preamble, the macros or a local package change.
+    If the preamble can not be dumped, the main file is left untouched and the document is compiled as usual.
+    Returns True if the format is used.
+    """
+    working_directory = os.path.dirname(file_path)
+    file_path_tex = file_path + ".tex"
+    with open(file_path_tex) as f:
+        lines = f.readlines()
+    parts = split_preamble(lines)
+    if parts is None:
+        return False
+
+    static, dynamic = parts
+    static_preamble = get_static_preamble(static)
+    format_hash = get_format_hash(static_preamble, working_directory)
+    cached_format = os.path.join(FORMAT_FOLDER, format_hash + ".fmt")
+    failure_marker = os.path.join(FORMAT_FOLDER, format_hash + ".failed")
+    local_format = os.path.join(working_directory, FORMAT_NAME + ".fmt")
+    if os.path.isfile(failure_marker):
+        return False
+
+    is_cached = os.path.isfile(cached_format)
+    if is_cached:
+        shutil.copyfile(cached_format, local_format)
+    elif not dump_format(static_preamble, working_directory):
+        _mark_failed(failure_marker)
+        return False
+
+    # The first line tells pdflatex which format to load
+    rewritten_lines = ["%&" + FORMAT_NAME + "\n"] + dynamic
+    _write_lines(file_path_tex, rewritten_lines)
+
+    if not is_cached:
+        if not check_format(file_path, lines, rewritten_lines):
+            _write_lines(file_path_tex, lines)
+            os.remove(local_format)
+            _mark_failed(failure_marker)
+            return False
+        create_dir(FORMAT_FOLDER)
+        # Copied then renamed so that concurrent builds never load a partial format
+        tmp_format = cached_format + "." + str(os.getpid())
+        shutil.copyfile(local_format, tmp_format)
+        os.replace(tmp_format, cached_format)
+    return True
+
+
+def _write_lines(path, lines):
+    with open(path, 'w') as f:
+        f.writelines(lines)
+
+
+def _mark_failed(failure_marker):
+    create_dir(FORMAT_FOLDER)
+    open(failure_marker, 'a').close()
@@ -0,0 +1,232 @@
+import itertools
+
+import numpy as np
+
+
+# Values taken by the numbers in the covering arrays (the bounds and evenly spaced values between them)
+COVERING_NUMBER_LEVELS = 3
+# Random rows among which each row of a covering array is chosen
+COVERING_CANDIDATES = 50
+# Draws made to replace the duplicates before giving up (as a multiple of the amount of configs requested)
+MAX_DRAW_FACTOR = 10
+# Methods of sample_configs
+SAMPLING_METHODS = ["random", "lhs", "pairwise", "exhaustive"]
+
+
+def get_dimensions(conf_source, fixed_values={}, number_levels=None):
+    """
+    Describes the space of the configs as a list of dimensions, one per variable (and one per group of choices).
+    Each dimension is a (names, size, values) tuple, where size is the amount of values the dimension can take and
+    values gets the values from an array of their indices, so that a config is represented by the indices of its
+    values in the dimensions.
+    The numbers take every value allowed by their precision, or number_levels evenly spaced values if it is set.
+    Their values are computed from the indices, as a wide range may have too many values to be stored.
+    The fixed values are the only value of their dimension, like in random_config.
+    """
+    dimensions = []
+    for name in conf_source.get("booleans", []):
+        values = [fixed_values[name]] if name in fixed_values else [True, False]
+        dimensions.append(_listed_dimension([name], np.array(values, dtype=object)))
+
+    for name, (min_bound, max_bound, precision) in conf_source.get("numbers", {}).items():
+        if name in fixed_values:
+            dimensions.append(_listed_dimension([name], np.array([fixed_values[name]], dtype=object)))
+            continue
+        nb_values = int(round((max_bound - min_bound) * 10 ** precision)) + 1
+        if number_levels:
+            nb_values = min(nb_values, number_levels)
+        # Evenly spaced values from min_bound to max_bound, like np.linspace
+        step = (max_bound - min_bound) / (nb_values - 1) if nb_values > 1 else 0.0
+        dimensions.append(([name], nb_values, _number_values(min_bound, step, precision)))
+
+    for name, options in conf_source.get("enums", {}).items():
+        values = [fixed_values[name]] if name in fixed_values else options
+        dimensions.append(_listed_dimension([name], np.array(values, dtype=object)))
+
+    for options in conf_source.get("choices", []):
+        selected = [o for o in options if fixed_values.get(o)]
+        # A group is encoded by the index of its selected option
+        values = [options.index(selected[-1])] if selected else list(range(len(options)))
+        dimensions.append(_listed_dimension(list(options), np.array(values)))
+    return dimensions
+
+
+def _listed_dimension(names, values):
+    return names, len(values), values.__getitem__
+
+
+def _number_values(min_bound, step, precision):
+    return lambda indices: np.round(min_bound + indices * step, precision)
+
+
+def space_size(dimensions):
+    """
+    Gets the amount of different configs in the space, as a Python int so it can not overflow.
+    """
+    size = 1
+    for _, dimension_size, _ in dimensions:
+        size *= dimension_size
+    return size
+
+
+def decode(dimensions, indices):
+    """
+    Transforms a matrix of value indices (one row per config, one column per dimension) into config dictionaries.
+    """
+    columns = {}
+    for column, (names, _, values) in enumerate(dimensions):
+        selection = values(indices[:, column])
+        if len(names) == 1:
+            columns[names[0]] = selection.tolist()
+        else:
+            for option_index, name in enumerate(names):
+                columns[name] = (selection == option_index).tolist()
+    variables = list(columns)
+    return [dict(zip(variables, row)) for row in zip(*columns.values())]
+
+
+def random_indices(dimensions, n, rng):
+    """
+    Draws n configs uniformly.
+    """
+    if not dimensions:
+        return np.zeros((n, 0), dtype=int)
+    return np.column_stack([rng.integers(0, size, n) for _, size, _ in dimensions])
+
+
+def lhs_indices(dimensions, n, rng):
+    """
+    Draws n configs with a Latin hypercube : each dimension is split in n strata of the same size, and every
+    stratum is used by exactly one config, so all the range of each variable is covered even with few configs.
+    """
+    columns = []
+    for _, size, _ in dimensions:
+        strata = (rng.permutation(n) + rng.random(n)) / n
+        columns.append(np.minimum((strata * size).astype(int), size - 1))
+    return np.column_stack(columns) if columns else np.zeros((n, 0), dtype=int)
+
+
+def exhaustive_indices(dimensions):
+    """
+    Enumerates every config of the space.
+    """
+    shape = [size for _, size, _ in dimensions]
+    return np.column_stack(np.unravel_index(np.arange(space_size(dimensions)), shape)) if shape \
+        else np.zeros((1, 0), dtype=int)
+
+
+def covering_indices(dimensions, rng, strength=2, max_rows=None):
+    """
+    Builds a covering array : configs such that, for every set of strength dimensions, each combination of their
+    values appears in at least one config (every pair of values with the default strength of 2).
+    The configs are chosen greedily among random candidates, the one covering the most new combinations being
+    kept each time, so the first rows cover the most and the array can be cut at max_rows.
+    """
+    if not dimensions:
+        return np.zeros((1, 0), dtype=int)
+    strength = min(strength, len(dimensions))
+    sizes = [size for _, size, _ in dimensions]
+    # For each set of dimensions, the combinations of values that are not covered yet
+    uncovered = {
+        combination: np.ones([sizes[d] for d in combination], dtype=bool)
+        for combination in itertools.combinations(range(len(dimensions)), strength)
+    }
+    remaining = sum(int(table.sum()) for table in uncovered.values())
+    rows = []
+    while remaining > 0 and (max_rows is None or len(rows) < max_rows):
+        candidates = random_indices(dimensions, COVERING_CANDIDATES, rng)
+        # The first uncovered combination is forced in a candidate so that every row covers something
+        combination, table = next((c, t) for c, t in uncovered.items() if t.any())
+        candidates[0, list(combination)] = np.argwhere(table)[0]
+        scores = np.zeros(len(candidates), dtype=int)
+        for combination, table in uncovered.items():
+            scores += table[tuple(candidates[:, d] for d in combination)]
+        best = candidates[np.argmax(scores)]
+        for combination, table in uncovered.items():
+            table[tuple(best[d] for d in combination)] = False
+        remaining -= int(scores.max())
+        rows.append(best)
+    return np.array(rows, dtype=int).reshape(len(rows), len(dimensions))
+
+
+def unique_rows(dimensions, indices):
+    """
+    Removes the duplicated configs, keeping the first occurrence of each one in its original order.
+    """
+    if len(indices) == 0:
+        return indices
+    if space_size(dimensions) < 2 ** 63:
+        # Each config is numbered in the space, which is much faster than comparing the rows
+        keys = np.ravel_multi_index(indices.T, [size for _, size, _ in dimensions]) if dimensions \
+            else np.zeros(len(indices), dtype=int)
+        _, first = np.unique(keys, return_index=True)
+    else:
+        _, first = np.unique(indices, axis=0, return_index=True)
+    return indices[np.sort(first)]
+
+
+def _fill(dimensions, indices, n, rng):
+    """
+    Completes a set of configs with random ones until there are n different configs, or until the space has been
+    covered or too many draws were duplicates.
+    """
+    indices = unique_rows(dimensions, indices)
+    n = min(n, space_size(dimensions))
+    draws = 0
+    while len(indices) < n and draws < MAX_DRAW_FACTOR * n:
+        missing = n - len(indices)
+        indices = unique_rows(dimensions, np.concatenate([indices, random_indices(dimensions, missing, rng)]))
+        draws += missing
+    return indices[:n]
+
+
+def sample_configs(conf_source, n, method="random", fixed_values={}, strength=2, seed=None):
+    """
+    Generates up to n different configs at once from the variables of a config source.
+    The methods are :
+    - "random" : uniform draws, like random_config ;
+    - "lhs" : a Latin hypercube, which spreads the values of each variable over its whole range ;
+    - "pairwise" : a covering array of the given strength, where the numbers take COVERING_NUMBER_LEVELS values,
+      completed with a Latin hypercube if n is larger than the array ;
+    - "exhaustive" : every config, if the space has at most n of them (a Latin hypercube otherwise).
+    Fewer than n configs are returned when the space is smaller than n.
+    """
+    rng = np.random.default_rng(seed)
+    dimensions = get_dimensions(conf_source, fixed_values)
+    if method == "exhaustive":
+        if space_size(dimensions) <= n:
+            return decode(dimensions, exhaustive_indices(dimensions))
+        print(f"The space has more than {n} configs, a Latin hypercube is used instead of the enumeration")
+        method = "lhs"
+
+    if method == "random":
+        indices = random_indices(dimensions, n, rng)
+    elif method == "lhs":
+        indices = lhs_indices(dimensions, n, rng)
+    elif method == "pairwise":
+        coarse = get_dimensions(conf_source, fixed_values, COVERING_NUMBER_LEVELS)
+        covering = covering_indices(coarse, rng, strength, n)
+        configs = decode(coarse, covering)
+        if len(configs) < n:
+            # Different values from the ones of the covering array are very likely
+            configs += sample_configs(conf_source, n - len(configs), "lhs", fixed_values, seed=rng)
+        return _unique_configs(configs)
+    else:
+        raise ValueError(f"Unknown sampling method : {method}")
+    return decode(dimensions, _fill(dimensions, indices, n, rng))
+
+
+def _unique_configs(configs):
+    unique = {}
+    for config in configs:
+        unique.setdefault(tuple(config.items()), config)
+    return list(unique.values())
+
+
+def batch_sampler(method, strength=2, seed=None):
+    """
+    Creates a sampler for generate_pdfs that builds the configs of sample_configs.
+    """
+    def sampler(conf_source, nb_gens, fixed_values, generate):
+        return generate(sample_configs(conf_source, nb_gens, method, fixed_values, strength, seed))
+    return sampler
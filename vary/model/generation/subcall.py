@@ -1,19 +1,127 @@
+import os
+import re
+import time
+import signal
+import threading
 import subprocess
 
+from vary.model.metrics import timed, record_child, is_recording
+
+# Default timeout of the programs, in seconds
 TIMEOUT = 15
+# Interval between two reads of the peak memory of the running program, in seconds
+MEMORY_POLL_INTERVAL = 0.05
+# Interval between two reads of the log of the running program, in seconds
+LOG_POLL_INTERVAL = 0.1
+# Lines of a TeX log after which the program can not produce a usable document
+FATAL_LOG_PATTERN = re.compile(
+    r"^!(?: Emergency stop| TeX capacity exceeded|  ==> Fatal error occurred)|^\(That makes 100 errors", re.MULTILINE
+)
+
+
+class FatalError(Exception):
+    """
+    Raised when the log of a program shows a fatal error. The message is the line of the log.
+    """
 
 
-def run_command(command, working_directory):
+def run_command(command, working_directory, timeout=None, log_path=None):
     """
     Calls a subprocess with the specified command.
-    Throws subprocess.TimeoutExpired if the program takes more than TIMEOUT seconds.
+    Throws subprocess.TimeoutExpired if the program takes more than timeout seconds (TIMEOUT by default).
+    If log_path is set, the log is removed before the program starts and read while it runs, and the program is
+    stopped with a FatalError as soon as a fatal error is written in it.
+    The program and the processes it started are killed together when it is stopped.
+    The time, the CPU time and the peak memory of the program are recorded in the "run_command" stage of the metrics.
+    """
+    timeout = timeout or TIMEOUT
+    if log_path and os.path.isfile(log_path):
+        os.remove(log_path)  # The log of the previous run must not stop this one
+    with timed("run_command"):
+        process = subprocess.Popen(
+            command, cwd=working_directory,
+            stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            close_fds=True, start_new_session=True
+        )
+        # The process is waited with wait4 to get its resource usage, while a thread watches it
+        done = threading.Event()
+        state = {"killed": None, "rss": None}
+        watcher = threading.Thread(
+            target=_watch, args=(process, done, state, timeout, log_path, is_recording()), daemon=True
+        )
+        watcher.start()
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+        finally:
+            done.set()
+        process.returncode = os.waitstatus_to_exitcode(status)
+        record_child(rusage, state["rss"])
+
+    if state["killed"] is not None:
+        _kill_group(process.pid)  # The helpers that are still running
+        if state["killed"] == "timeout":
+            raise subprocess.TimeoutExpired(command, timeout)
+        raise FatalError(state["killed"])
+
+
+def _watch(process, done, state, timeout, log_path, sample_memory):
+    """
+    Kills the process after timeout seconds, or when its log shows a fatal error. If sample_memory is set, reads
+    its peak memory regularly, as the peak memory given by wait4 includes the memory of the parent process before
+    the program is started.
     """
-    process = subprocess.Popen(
-        command, cwd=working_directory,
-        stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
-        close_fds=True
+    deadline = time.monotonic() + timeout
+    interval = min(
+        MEMORY_POLL_INTERVAL if sample_memory else timeout,
+        LOG_POLL_INTERVAL if log_path else timeout
     )
-    process.wait(timeout=TIMEOUT)
+    log_offset = 0
+    while not done.wait(max(0, min(interval, deadline - time.monotonic()))):
+        if time.monotonic() >= deadline:
+            state["killed"] = "timeout"
+        elif log_path:
+            fatal_error, log_offset = _find_fatal_error(log_path, log_offset)
+            if fatal_error:
+                state["killed"] = fatal_error
+        if state["killed"] is not None:
+            _kill_group(process.pid)
+            return
+        if sample_memory:
+            state["rss"] = _read_peak_rss(process.pid) or state["rss"]
 
-    if process is not None:
-        process.kill()
+
+def _find_fatal_error(log_path, offset):
+    """
+    Looks for a fatal error in the lines added to the log since offset.
+    Returns the line of the error (or None) and the offset of the first line that has not been read entirely.
+    """
+    try:
+        with open(log_path, 'rb') as f:
+            f.seek(offset)
+            content = f.read()
+    except OSError:
+        return None, offset
+    end = content.rfind(b"\n") + 1
+    match = FATAL_LOG_PATTERN.search(content[:end].decode(errors="replace"))
+    return (match.group(0).lstrip("!( ") if match else None), offset + end
+
+
+def _kill_group(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _read_peak_rss(pid):
+    """
+    Reads the peak resident memory of a running process in bytes, or None if it is not available (outside Linux).
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
@@ -0,0 +1,87 @@
+import os
+import atexit
+import threading
+
+from vary.model.files.directory import MACROS_PATH, remove_directory
+from vary.model.generation.generate import prepare_workspace
+
+_lock = threading.Lock()
+# Prepared working directories that are not used, with the fingerprint of their sources, by (source, filename,
+# precompile)
+_free = {}
+# Key and fingerprint of the working directories being used
+_used = {}
+
+
+def source_fingerprint(source):
+    """
+    Summarizes the names, sizes and modification times of the files of a project, and of the VaryLaTeX macros.
+    It changes when a file is uploaded, replaced or removed, without reading the files.
+    """
+    entries = []
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for name in sorted(files):
+            stat = os.stat(os.path.join(root, name))
+            entries.append((os.path.relpath(os.path.join(root, name), source), stat.st_size, stat.st_mtime_ns))
+    stat = os.stat(MACROS_PATH)
+    entries.append((MACROS_PATH, stat.st_size, stat.st_mtime_ns))
+    return hash(tuple(entries))
+
+
+def acquire_workspace(source, filename, precompile=True):
+    """
+    Gets a working directory prepared for the project (see prepare_workspace), which must be given back with
+    release_workspace. A working directory released earlier is reused if the sources have not changed since it was
+    prepared, so the space indicator and the bibliography are not generated again.
+    """
+    key = (source, filename, precompile)
+    fingerprint = source_fingerprint(source)
+    outdated = []
+    temp_path = None
+    with _lock:
+        for other_key in list(_free):
+            # The sources of a project replaced by another one are outdated too
+            if other_key[0] == source and (other_key != key or _free[other_key][0] != fingerprint):
+                outdated += _free.pop(other_key)[1]
+        if key in _free and _free[key][1]:
+            temp_path = _free[key][1].pop()
+    for path in outdated:
+        remove_directory(path)
+
+    if temp_path is None:
+        temp_path = prepare_workspace(source, filename, precompile)
+    with _lock:
+        _used[temp_path] = (key, fingerprint)
+    return temp_path
+
+
+def release_workspace(temp_path, reusable=True):
+    """
+    Gives back a working directory of acquire_workspace. It is kept for the next builds of the project unless
+    reusable is False, for instance when a compilation failed and may have left broken auxiliary files.
+    """
+    with _lock:
+        key, fingerprint = _used.pop(temp_path)
+    # The sources may have changed during the build
+    outdated = [temp_path]
+    if reusable and source_fingerprint(key[0]) == fingerprint:
+        with _lock:
+            if key in _free and _free[key][0] != fingerprint:
+                outdated += _free.pop(key)[1]
+            _free.setdefault(key, (fingerprint, []))[1].append(temp_path)
+        outdated.remove(temp_path)
+    for path in outdated:
+        remove_directory(path)
+
+
+@atexit.register
+def clear_workspaces():
+    """
+    Removes the working directories that are not used.
+    """
+    with _lock:
+        paths = [path for _, paths in _free.values() for path in paths]
+        _free.clear()
+    for path in paths:
+        remove_directory(path)
@@ -0,0 +1,144 @@
+import time
+import uuid
+import threading
+
+# Jobs by id, kept after they finish so their status can still be read
+_jobs = {}
+_lock = threading.Lock()
+
+# Time during which a finished job is kept, in seconds
+FINISHED_JOB_TTL = 3600
+# Amount of finished jobs kept at most, the oldest ones are removed first
+MAX_FINISHED_JOBS = 100
+
+# Attributes of a job that are given to the clients
+PUBLIC_FIELDS = ["id", "status", "total", "completed", "failed", "started", "finished", "error"]
+
+
+def start_job(total, target, exclusive=False, **info):
+    """
+    Runs target in a background thread and returns the id of the job.
+    target is called with two arguments : a function to call with each row once it has been generated, and
+    an event that is set when the job is cancelled, which target should check between two rows.
+    total is the expected amount of rows, used to estimate the remaining time.
+    If exclusive is set, the job is not started and None is returned when another job is running. The check and
+    the start are atomic, so two exclusive jobs never run at the same time.
+    The other keyword arguments are stored in the job and can be read with get_job.
+    """
+    job = dict(info)
+    job.update({
+        "id": uuid.uuid4().hex,
+        "status": "running",
+        "total": total,
+        "completed": 0,
+        "failed": 0,
+        "started": time.time(),
+        "finished": None,
+        "error": None,
+        "version": 0,
+        "cancel": threading.Event(),
+        "condition": threading.Condition(_lock)
+    })
+    with _lock:
+        if exclusive and any(is_running(other) for other in _jobs.values()):
+            return None
+        _evict_finished_jobs()
+        _jobs[job["id"]] = job
+
+    def progress(row):
+        with _lock:
+            # A row without a page count comes from a document that could not be built
+            if row.get("nbPages") is None:
+                job["failed"] += 1
+            else:
+                job["completed"] += 1
+            _notify(job)
+
+    def run():
+        try:
+            target(progress, job["cancel"])
+            status, error = ("cancelled" if job["cancel"].is_set() else "done"), None
+        except Exception as e:
+            status, error = "error", str(e)
+        with _lock:
+            job["status"] = status
+            job["error"] = error
+            job["finished"] = time.time()
+            _notify(job)
+
+    threading.Thread(target=run, daemon=True).start()
+    return job["id"]
+
+
+def _evict_finished_jobs():
+    """
+    Removes the finished jobs older than FINISHED_JOB_TTL, and the oldest ones beyond MAX_FINISHED_JOBS.
+    """
+    finished = sorted((job for job in _jobs.values() if not is_running(job)), key=lambda job: job["finished"])
+    expired = time.time() - FINISHED_JOB_TTL
+    for index, job in enumerate(finished):
+        if job["finished"] < expired or index < len(finished) - MAX_FINISHED_JOBS:
+            del _jobs[job["id"]]
+
+
+def _notify(job):
+    job["version"] += 1
+    job["condition"].notify_all()
+
+
+def get_job(job_id):
+    """
+    Gets the job with the specified id, or None if there is no such job.
+    """
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def is_running(job):
+    return job["status"] == "running"
+
+
+def get_status(job):
+    """
+    Creates the public status of a job, with the estimated remaining time in seconds (null until a row is done).
+    """
+    with _lock:
+        return _get_status(job)
+
+
+def _get_status(job):
+    status = {k: job[k] for k in PUBLIC_FIELDS}
+    done = job["completed"] + job["failed"]
+    if not is_running(job):
+        status["eta"] = 0
+    elif done:
+        status["eta"] = (time.time() - job["started"]) / done * (job["total"] - done)
+    else:
+        status["eta"] = None
+    return status
+
+
+def wait_for_update(job, version, timeout=15):
+    """
+    Waits until the job changes after the specified version, or until the timeout.
+    Returns the status of the job and its current version.
+    """
+    with _lock:
+        job["condition"].wait_for(lambda: job["version"] != version or not is_running(job), timeout)
+        return _get_status(job), job["version"]
+
+
+def wait_for_job(job):
+    """
+    Waits until the job ends and returns its status.
+    """
+    with _lock:
+        job["condition"].wait_for(lambda: not is_running(job))
+        return _get_status(job)
+
+
+def cancel_job(job):
+    """
+    Asks a job to stop. The rows being generated are finished but no other one is started.
+    """
+    job["cancel"].set()
@@ -0,0 +1,143 @@
+import time
+import threading
+
+from contextlib import contextmanager
+
+# Upper bounds of the buckets of the histograms
+TIME_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+RSS_BUCKETS = [2 ** n * 1024 * 1024 for n in range(3, 13)]  # From 8MiB to 4GiB
+
+# Histograms of the Prometheus output, with their help text and buckets
+METRICS = {
+    "wall": ("vary_stage_wall_seconds", "Wall clock time of the stages", TIME_BUCKETS),
+    "cpu": ("vary_stage_cpu_seconds", "CPU time of the stages, including their child processes", TIME_BUCKETS),
+    "rss": ("vary_stage_peak_rss_bytes", "Peak resident memory of the child processes of the stages", RSS_BUCKETS)
+}
+
+# Off by default so that the scripts do not pay for the histograms, the server enables it (see views/metrics.py)
+_enabled = False
+_lock = threading.Lock()
+# Histograms by (metric, stage) : the count of each bucket (not cumulative), the sum and the count
+_histograms = {}
+# Timings of the current thread, see collect_timings
+_local = threading.local()
+
+
+def set_enabled(enabled):
+    """
+    Enables or disables the recording of the timings. When disabled, a stage only costs a function call.
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def is_recording():
+    """
+    Tells if the stages run by the current thread are measured.
+    """
+    return _enabled or getattr(_local, "timings", None) is not None
+
+
+@contextmanager
+def timed(stage):
+    """
+    Measures the wall clock time and the CPU time spent in the block, the CPU time of the child processes that
+    ended in it (see record_child) and their peak resident memory.
+    """
+    if not is_recording():
+        yield
+        return
+    start_wall = time.perf_counter()
+    start_cpu = time.thread_time()
+    start_child_cpu = getattr(_local, "child_cpu", 0.0)
+    start_rss = getattr(_local, "child_rss", None)
+    _local.child_rss = None
+    try:
+        yield
+    finally:
+        child_cpu = getattr(_local, "child_cpu", 0.0) - start_child_cpu
+        rss = _local.child_rss
+        # The peak of the enclosing stage includes this one
+        _local.child_rss = rss if start_rss is None else max(start_rss, rss or 0)
+        record(stage, time.perf_counter() - start_wall, time.thread_time() - start_cpu + child_cpu, rss)
+
+
+def record_child(rusage, rss=None):
+    """
+    Adds the CPU time of a child process that ended (the resource usage given by os.wait4) and its peak memory
+    in bytes, if it is known, to the running stages of the thread.
+    """
+    if not is_recording():
+        return
+    _local.child_cpu = getattr(_local, "child_cpu", 0.0) + rusage.ru_utime + rusage.ru_stime
+    if rss is not None:
+        current = getattr(_local, "child_rss", None)
+        _local.child_rss = rss if current is None else max(current, rss)
+
+
+def record(stage, wall, cpu=None, rss=None):
+    """
+    Adds the measures of a run of a stage to the histograms, and to the timings collected by the thread.
+    """
+    values = {"wall": wall, "cpu": cpu, "rss": rss}
+    timings = getattr(_local, "timings", None)
+    if timings is not None:
+        for metric, value in values.items():
+            if value is not None:
+                key = (stage, metric)
+                timings[key] = max(timings[key], value) if metric == "rss" and key in timings \
+                    else timings.get(key, 0) + value
+    if not _enabled:
+        return
+    with _lock:
+        for metric, value in values.items():
+            if value is None:
+                continue
+            _, _, buckets = METRICS[metric]
+            histogram = _histograms.get((metric, stage))
+            if histogram is None:
+                histogram = _histograms[(metric, stage)] = {"buckets": [0] * len(buckets), "sum": 0, "count": 0}
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+                    break
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+
+@contextmanager
+def collect_timings():
+    """
+    Gathers the measures of the stages run by the current thread in the block, even if the recording is disabled.
+    Yields a dictionary with (stage, metric) keys, where the runs of a stage are added (the maximum is kept for
+    the memory).
+    """
+    previous = getattr(_local, "timings", None)
+    _local.timings = {}
+    try:
+        yield _local.timings
+    finally:
+        _local.timings = previous
+
+
+def render_prometheus():
+    """
+    Creates the histograms of all the stages in the Prometheus text format.
+    """
+    lines = []
+    with _lock:
+        for metric, (name, help_text, buckets) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (histogram_metric, stage), histogram in sorted(_histograms.items()):
+                if histogram_metric != metric:
+                    continue
+                label = 'stage="' + stage.replace("\\", "\\\\").replace('"', '\\"') + '"'
+                cumulative = 0
+                for bound, count in zip(buckets, histogram["buckets"]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{label},le="+Inf"}} {histogram["count"]}')
+                lines.append(f"{name}_sum{{{label}}} {histogram['sum']}")
+                lines.append(f"{name}_count{{{label}}} {histogram['count']}")
+    return "\n".join(lines) + "\n"
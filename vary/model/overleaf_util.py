@@ -3,12 +3,24 @@ import requests
 import re
 import json
 import zipfile
+import zlib
+import shutil
+import tempfile
 import os
 
+from urllib.parse import urlparse
 
-def fetch_overleaf(invite_key, output_folder):
+OVERLEAF_URL = "https://www.overleaf.com"
+# Size of the chunks of the downloaded archive, in bytes
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def fetch_overleaf(invite_key, output_folder, base_url=OVERLEAF_URL):
     """
     Gets the content of a LaTeX project on Overleaf, from a READ-ONLY invite link and exports it to the output folder
+    (see sync_archive), which then only contains the files of the project.
+    base_url is the address of the Overleaf server.
+    Returns the paths of the files written and removed, relative to the output folder.
     """
 
     if not re.match("[a-z]+", invite_key):
@@ -16,7 +28,7 @@ def fetch_overleaf(invite_key, output_folder):
                     b"after the '/read/' in the read-only link\n")
         exit()
 
-    invite_url = "https://www.overleaf.com/read/" + invite_key
+    invite_url = base_url + "/read/" + invite_key
     grant_url = invite_url + "/grant"
     session = requests.Session()
 
@@ -40,10 +52,9 @@ def fetch_overleaf(invite_key, output_folder):
         "Connection": "keep-alive",
         "Content-Type": "application/json;charset=utf-8",
         "User-Agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:77.0) Gecko/20100101 Firefox/77.0",
-        "Host": "www.overleaf.com",
-        "Origin": "https://www.overleaf.com",
-        "TE": "Trailers",
-        "Content-Length": "48"
+        "Host": urlparse(base_url).netloc,
+        "Origin": base_url,
+        "TE": "Trailers"
     }
 
     # CSRF token used to validate the POST request
@@ -68,19 +79,66 @@ def fetch_overleaf(invite_key, output_folder):
     # Real path of the project
     project_path = json.loads(r.content)['redirect']
 
-    zip_name = "sources.zip"
-    download_url = "https://www.overleaf.com%s/download/zip" % project_path
-    # Download the project
+    download_url = base_url + "%s/download/zip" % project_path
+    # Download the project in a temporary file, so the output folder is left untouched if the download fails
     r = session.get(download_url, stream=True)
-    # Write the response to a zip file
-    with open(zip_name, 'wb') as f:
-        for chunk in r.iter_content(chunk_size=1024): 
-            if chunk:
-                f.write(chunk)
-
-    # Extract the file to the specified folder
-    with zipfile.ZipFile("sources.zip", "r") as zip_ref:
-        zip_ref.extractall(output_folder)
-
-    # Clean the archive
-    os.remove(zip_name)
+    r.raise_for_status()
+    with tempfile.TemporaryFile() as f:
+        for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            f.write(chunk)
+        f.seek(0)
+        with zipfile.ZipFile(f, "r") as zip_ref:
+            return sync_archive(zip_ref, output_folder)
+
+
+def sync_archive(zip_ref, output_folder):
+    """
+    Extracts an archive over a folder, only writing the files whose content changed, and removes the files that
+    are not in the archive. The unchanged files keep their modification time, so the caches that depend on the
+    sources (compilation results, bibliography, prepared workspaces) stay valid.
+    Returns the paths of the files written and removed, relative to the output folder.
+    """
+    root = os.path.realpath(output_folder)
+    written = []
+    names = set()
+    for info in zip_ref.infolist():
+        path = os.path.realpath(os.path.join(root, info.filename))
+        if not path.startswith(root + os.sep):
+            continue  # Paths outside the folder are ignored, like extractall does
+        name = os.path.relpath(path, root)
+        names.add(name)
+        if info.is_dir():
+            os.makedirs(path, exist_ok=True)
+        elif not _same_content(path, info):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with zip_ref.open(info) as src, open(tmp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, DOWNLOAD_CHUNK_SIZE)
+            os.replace(tmp_path, path)
+            written.append(name)
+
+    removed = []
+    for current, dirs, files in os.walk(root, topdown=False):
+        for file_name in files:
+            name = os.path.relpath(os.path.join(current, file_name), root)
+            if name not in names:
+                os.remove(os.path.join(current, file_name))
+                removed.append(name)
+        for dir_name in dirs:
+            path = os.path.join(current, dir_name)
+            if os.path.relpath(path, root) not in names and not os.listdir(path):
+                os.rmdir(path)
+    return written, removed
+
+
+def _same_content(path, info):
+    """
+    Compares a file with a member of an archive through their size and CRC-32, without extracting the member.
+    """
+    if not os.path.isfile(path) or os.path.getsize(path) != info.file_size:
+        return False
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc == info.CRC
@@ -0,0 +1,91 @@
+import time
+import queue
+import itertools
+import threading
+
+from concurrent.futures import Future
+
+# Priority classes, the lowest value is served first
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+_queue = queue.PriorityQueue()
+_counter = itertools.count()  # Keeps the tasks of a same class in submission order
+_lock = threading.Lock()
+_workers = []
+_max_workers = 1
+_stats = {
+    name: {"queued": 0, "running": 0, "completed": 0, "waitCount": 0, "waitTotal": 0.0, "waitMax": 0.0}
+    for name in PRIORITY_NAMES.values()
+}
+
+
+def set_max_workers(max_workers):
+    """
+    Sets the amount of tasks that can run at the same time. Existing workers are kept if the value decreases.
+    """
+    global _max_workers
+    with _lock:
+        _max_workers = max(1, max_workers)
+
+
+def submit(priority, fn, *args, **kwargs):
+    """
+    Schedules fn(*args, **kwargs) and returns a concurrent.futures.Future.
+    The queued tasks of a class only start when there is no queued task with a higher priority, so an
+    interactive build waits at most for the tasks already running. A task can be cancelled until it starts.
+    """
+    stats = _stats[PRIORITY_NAMES[priority]]
+    future = Future()
+    with _lock:
+        stats["queued"] += 1
+        if len(_workers) < _max_workers:
+            worker = threading.Thread(target=_work, daemon=True)
+            _workers.append(worker)
+            worker.start()
+    future.add_done_callback(lambda f: f.cancelled() and _dequeue(stats))
+    _queue.put((priority, next(_counter), time.time(), future, fn, args, kwargs))
+    return future
+
+
+def _dequeue(stats):
+    with _lock:
+        stats["queued"] -= 1
+
+
+def _work():
+    while True:
+        priority, _, submitted, future, fn, args, kwargs = _queue.get()
+        # A cancelled task has already been removed from the statistics
+        if not future.set_running_or_notify_cancel():
+            continue
+        stats = _stats[PRIORITY_NAMES[priority]]
+        wait_time = time.time() - submitted
+        with _lock:
+            stats["queued"] -= 1
+            stats["running"] += 1
+            stats["waitCount"] += 1
+            stats["waitTotal"] += wait_time
+            stats["waitMax"] = max(stats["waitMax"], wait_time)
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        with _lock:
+            stats["running"] -= 1
+            stats["completed"] += 1
+
+
+def get_stats():
+    """
+    Gets the queue depth, the running and completed tasks and the time spent waiting in the queue, in seconds,
+    for every priority class.
+    """
+    with _lock:
+        result = {"maxWorkers": _max_workers, "classes": {}}
+        for name, stats in _stats.items():
+            class_stats = {k: stats[k] for k in ["queued", "running", "completed", "waitMax"]}
+            class_stats["waitMean"] = stats["waitTotal"] / stats["waitCount"] if stats["waitCount"] else 0
+            result["classes"][name] = class_stats
+        return result
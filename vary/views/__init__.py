@@ -3,4 +3,6 @@ import vary.views.index
 import vary.views.constraints
 import vary.views.project_files
 import vary.views.select_mode
-import vary.views.free_config
\ No newline at end of file
+import vary.views.free_config
+import vary.views.jobs
+import vary.views.metrics
@@ -1,28 +1,70 @@
 import os
 import json
 
+from functools import partial
 from flask import session, send_from_directory, request, g
 from shutil import copyfile
 
-from vary import app
-from vary.model.generation.compile import generate_bbl
-from vary.model.generation.generate import generate_random, generate_pdfs
-from vary.model.files.directory import create_temporary_copy, remove_directory
-from vary.model.files.tex_injection import inject_space_indicator
+from vary import app, RESULT_FOLDER
+from vary.model.generation.generate import random_config, generate_pdf, generate_pdfs, prepare_workspace, \
+    load_cached_row
+from vary.model.generation.cache import hash_sources
+from vary.model.generation.workspace_pool import acquire_workspace, release_workspace
+from vary.model.generation.sampling import batch_sampler
+from vary.model.files.directory import remove_directory
+from vary.model.scheduler import submit, get_stats, BULK, INTERACTIVE
+from vary.model.jobs import start_job, get_job, wait_for_job
 
 
-@app.route('/generate_pdfs/<int:generations>', methods=["POST"])
-def compile_pdfs(generations, reset=True):
+def generation_options():
     """
-    Builds the specified amount of documents. If reset is set to True,
-    discards the data about the previouslly generated documents.
+    Gets the options of generate_pdfs defined in the config of the server.
+    """
+    return {
+        "jobs": app.config['COMPILE_JOBS'],
+        "use_cache": app.config['COMPILE_CACHE'],
+        "precompile": app.config['PRECOMPILE_PREAMBLE'],
+        "measure_only": app.config['MEASURE_ONLY'],
+        "sampler": batch_sampler(app.config['SAMPLING']),
+        "timings": app.config['TIMING_COLUMNS'],
+        "prune_unused": app.config['PRUNE_UNUSED_VARIABLES'],
+        # The compilations are queued behind the interactive builds
+        "submit": partial(submit, BULK)
+    }
+
+
+def start_generation_job(generations, reset=True):
+    """
+    Starts building the specified amount of documents in a background job (see start_job), with the fixed values
+    of the request. If reset is set to True, discards the data about the previously generated documents.
+    Returns the id of the job, or None if a generation is already running, as they all write to the same file.
     """
-    output = "vary/results"
     fixed_values = request.json or {}
     filename = session['main_file_name'].replace(".tex", "")  # main file name without extension
     source = app.config['UPLOAD_FOLDER']  # The project is located in the "source" folder
+    options = generation_options()
+    result_path = os.path.join(RESULT_FOLDER, "result.csv")
+
+    def target(progress, cancel):
+        generate_pdfs(filename, source, RESULT_FOLDER, generations, reset, fixed_values,
+                      progress=progress, cancel=cancel, **options)
+
+    return start_job(generations, target, exclusive=True, result_path=result_path)
 
-    generate_pdfs(filename, source, output, generations, reset, fixed_values)
+
+@app.route('/generate_pdfs/<int:generations>', methods=["POST"])
+def compile_pdfs(generations, reset=True):
+    """
+    Builds the specified amount of documents. If reset is set to True,
+    discards the data about the previouslly generated documents.
+    The documents are built by a job, so the generation can not run at the same time as another one.
+    """
+    job_id = start_generation_job(generations, reset)
+    if job_id is None:
+        return json.dumps({"error": "A generation is already running"}), 409, {'Content-Type': 'application/json'}
+    status = wait_for_job(get_job(job_id))
+    if status["status"] == "error":
+        return json.dumps({"error": status["error"]}), 500, {'Content-Type': 'application/json'}
     return send_from_directory("results", "result.csv")
 
 @app.route('/add_pdfs/<int:generations>', methods=["POST"])
@@ -45,27 +87,56 @@ def build_pdf():
         resp.headers['Cache-Control'] = 'max-age=0, no-cache, must-revalidate'
         return resp
 
-    config = request.json
     output = "vary/results"
     source = os.path.join(app.config['UPLOAD_FOLDER'])
-    temp_path = create_temporary_copy(source)
-    file_path = os.path.join(temp_path, filename)
-
-    inject_space_indicator(file_path)
-    generate_bbl(file_path)
 
     conf_source_path = os.path.join(source, "variables.json")
     with open(conf_source_path) as f:
         conf_source = json.load(f)
-
-    generate_random(conf_source, filename, temp_path, config)
+    config = random_config(conf_source, request.json)
 
     outpath = os.path.join(output, filename + ".pdf")
     if os.path.exists(outpath):
         os.remove(outpath)
-    copyfile(
-        os.path.join(temp_path, filename + ".pdf"),
-        os.path.join(outpath)
-    )
-    remove_directory(temp_path)
+
+    source_hash = hash_sources(source) if app.config['COMPILE_CACHE'] else None
+    # A document already compiled is copied from the cache without creating a working directory
+    if source_hash and load_cached_row(config, filename, source_hash, outpath) is not None:
+        return '{"success":true}', 200, {'ContentType': 'application/json'}
+
+    # The build goes before the queued bulk compilations
+    precompile = app.config['PRECOMPILE_PREAMBLE']
+    row = submit(INTERACTIVE, _build_pdf, config, filename, source, outpath, source_hash, precompile).result()
+    if row.get("failure"):
+        return json.dumps({"success": False, "error": row["failure"]}), 500, {'ContentType': 'application/json'}
     return '{"success":true}', 200, {'ContentType': 'application/json'}
+
+
+def _build_pdf(config, filename, source, outpath, source_hash, precompile):
+    # The working directory of the previous build is reused while the sources do not change
+    if app.config['REUSE_WORKSPACES']:
+        temp_path = acquire_workspace(source, filename, precompile)
+    else:
+        temp_path = prepare_workspace(source, filename, precompile)
+    row = None
+    try:
+        row = generate_pdf(config, filename, temp_path, source_hash, cache_pdf=True)
+        if not row.get("failure"):
+            copyfile(
+                os.path.join(temp_path, filename + ".pdf"),
+                os.path.join(outpath)
+            )
+    finally:
+        if app.config['REUSE_WORKSPACES']:
+            release_workspace(temp_path, reusable=row is not None and not row.get("failure"))
+        else:
+            remove_directory(temp_path)
+    return row
+
+
+@app.route('/scheduler/stats')
+def scheduler_stats():
+    """
+    Gets the queue depth and the waiting times of the interactive and bulk compilations.
+    """
+    return json.dumps(get_stats()), 200, {'Content-Type': 'application/json'}
@@ -1,10 +1,18 @@
 import os
 import json
 
-from flask import render_template, send_from_directory, request
+from flask import render_template, send_from_directory, request, abort
 
-from vary import app, RESULT_FOLDER
-from vary.model.decision_trees.analysis import eval_options, decision_tree, visualize_tree
+from vary import app, RESULT_FOLDER, SERVER_RESULTS_FOLDER
+from vary.model.decision_trees.analysis import eval_options
+from vary.model.decision_trees.model_cache import get_decision_tree, get_regression_tree
+from vary.model.decision_trees.surrogate import feasibility_tree
+from vary.model.decision_trees.rendering import request_render, get_rendered, render_key, RENDER_FORMATS
+
+# Folder of the images of the trees, in the results
+TREE_FOLDER = "trees"
+# Time waited by /tree_img for a tree being rendered, in seconds
+TREE_RENDER_WAIT = 10
 
 @app.route('/constraints')
 def constraints():
@@ -13,8 +21,18 @@ def constraints():
 
 @app.route('/tree_img')
 def get_tree():
-    response = send_from_directory("results", 'dt.png')
-    response.headers['Cache-Control'] = 'no-store'
+    """
+    Gets the image of the latest decision tree, in PNG or in SVG with ?format=svg.
+    The images of a tree never change, so the browser can revalidate its copy with its ETag.
+    """
+    image_format = request.args.get("format", "png")
+    if image_format not in RENDER_FORMATS:
+        abort(404)
+    key = get_rendered(os.path.join(RESULT_FOLDER, TREE_FOLDER), TREE_RENDER_WAIT)
+    if key is None:
+        abort(404)
+    response = send_from_directory(os.path.join(SERVER_RESULTS_FOLDER, TREE_FOLDER), key + "." + image_format)
+    response.headers['Cache-Control'] = 'no-cache'
     return response
 
 @app.route("/predict/<int:max_pages>", methods=["POST"])
@@ -26,10 +44,19 @@ def predict(max_pages):
 
     csv_path = os.path.join(RESULT_FOLDER, "result.csv")
 
-    classifier, features = decision_tree(csv_path, max_pages)
-
-    tree_path = os.path.join(RESULT_FOLDER, "dt.png")
-    visualize_tree(classifier, features, RESULT_FOLDER)
-
-    probas = eval_options(classifier, config, conf_source, features)
+    # The tree is only trained again when rows have been added to the results
+    if app.config['PREDICTION_MODEL'] == "regression":
+        # The same tree is used for every page limit
+        surrogate, _ = get_regression_tree(csv_path)
+        classifier, features = surrogate["regressor"], surrogate["features"]
+        tree = feasibility_tree(surrogate, max_pages)
+    else:
+        classifier, features, _ = get_decision_tree(csv_path, max_pages)
+        tree = None
+
+    # The image is rendered in the background, the probabilities do not wait for it
+    key = render_key(classifier, features)
+    request_render(classifier, features, key, os.path.join(RESULT_FOLDER, TREE_FOLDER))
+
+    probas = eval_options(classifier, config, conf_source, features, tree)
     return json.dumps(probas)
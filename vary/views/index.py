@@ -8,6 +8,7 @@ from vary import app, ALLOWED_EXTENSIONS
 from vary.model.overleaf_util import fetch_overleaf
 from vary.model.files.directory import clear_directory
 from vary.model.files.dictionnaries import init_variables_json
+from vary.model.files.project_index import update_index
 
 @app.route('/', methods=["GET", "POST"])
 def index():
@@ -40,14 +41,16 @@ def upload_project():
             zip_ref.extractall(upload_folder)
         os.remove(filepath)
         init_variables_json(upload_folder)
+        update_index(upload_folder)
         return redirect(url_for('selectfile'))
 
 @app.route('/import_overleaf', methods=['POST'])
 def import_overleaf():
     upload_folder = app.config['UPLOAD_FOLDER']
     key = request.form.get('key')
-    clear_directory(upload_folder)  # Delete potential previous project
-    fetch_overleaf(key, upload_folder)
+    # Only the files that changed since the previous import are replaced
+    fetch_overleaf(key, upload_folder, app.config['OVERLEAF_URL'])
+    update_index(upload_folder)
     return redirect(url_for('selectfile'))
 
 def check_filename(filename):
@@ -0,0 +1,90 @@
+import json
+
+from flask import abort, Response
+
+from vary import app
+from vary.model.jobs import get_job, get_status, cancel_job, wait_for_update
+from vary.views.compile import start_generation_job
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+@app.route('/jobs/generate_pdfs/<int:generations>', methods=["POST"])
+def start_generation(generations, reset=True):
+    """
+    Starts building the specified amount of documents in the background and returns the id of the job.
+    If reset is set to True, discards the data about the previously generated documents.
+    """
+    job_id = start_generation_job(generations, reset)
+    if job_id is None:
+        return json.dumps({"error": "A generation is already running"}), 409, JSON_HEADERS
+    return json.dumps({"id": job_id}), 202, JSON_HEADERS
+
+
+@app.route('/jobs/add_pdfs/<int:generations>', methods=["POST"])
+def start_addition(generations):
+    """
+    Starts building the specified amount of documents in the background, and appends them to the previously
+    generated ones.
+    """
+    return start_generation(generations, reset=False)
+
+
+def _get_job_or_404(job_id):
+    job = get_job(job_id)
+    if job is None:
+        abort(404)
+    return job
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    Gets the amount of completed and failed documents of a job, its status and the estimated remaining time.
+    """
+    return json.dumps(get_status(_get_job_or_404(job_id))), 200, JSON_HEADERS
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """
+    Streams the status of a job with Server-Sent Events, each time a document is built, until the job ends.
+    """
+    job = _get_job_or_404(job_id)
+
+    def stream():
+        version = None
+        while True:
+            # The status is also sent when nothing changed for a while, which keeps the connection alive
+            status, version = wait_for_update(job, version)
+            yield "data: %s\n\n" % json.dumps(status)
+            if status["status"] != "running":
+                break
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream(), mimetype="text/event-stream", headers=headers)
+
+
+@app.route('/jobs/<job_id>/cancel', methods=["POST"])
+def cancel(job_id):
+    """
+    Stops a job : the documents being built are finished but no other one is started.
+    """
+    job = _get_job_or_404(job_id)
+    cancel_job(job)
+    return json.dumps(get_status(job)), 200, JSON_HEADERS
+
+
+@app.route('/jobs/<job_id>/result.csv')
+def job_result(job_id):
+    """
+    Gets the rows generated so far by a job. Only complete lines are sent while the job is running.
+    """
+    job = _get_job_or_404(job_id)
+    try:
+        with open(job["result_path"], 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        content = b""
+    content = content[:content.rfind(b"\n") + 1]
+    return Response(content, mimetype="text/csv")
@@ -0,0 +1,35 @@
+import time
+
+from flask import request, g
+
+from vary import app
+from vary.model.metrics import record, render_prometheus, set_enabled
+
+
+@app.before_request
+def start_timer():
+    if app.config['METRICS']:
+        # Only a running server records the metrics, not the scripts that import the package
+        set_enabled(True)
+        g.request_start = (time.perf_counter(), time.thread_time())
+
+
+@app.teardown_request
+def record_request(exception=None):
+    """
+    Records the time spent in every route, as the "route:<rule>" stage.
+    """
+    start = g.pop("request_start", None)
+    if start is None or request.url_rule is None:
+        return
+    start_wall, start_cpu = start
+    record("route:" + request.url_rule.rule, time.perf_counter() - start_wall, time.thread_time() - start_cpu)
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Gets the histograms of the time spent in the stages of the generation and in the routes, in the Prometheus
+    text format.
+    """
+    return render_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
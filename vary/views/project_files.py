@@ -1,11 +1,12 @@
 import os
 import json
-import re
 
 from flask import request, redirect, url_for, render_template, session, send_from_directory
 
 from vary import app
-from vary.model.files.tex_injection import add_graphics_variables, add_include_macros_variables, add_itemsep_variable
+from vary.model.files.tex_injection import add_include_macros_variables, prepare_project
+from vary.model.files.project_index import get_main_files
+from vary.model.files.variable_usage import analyze_variables
 
 VARIABLE_FILE_NAME = "variables.json"
 
@@ -26,21 +27,9 @@ def selectfile():
 def get_filenames():
     """
     Gets the potential main tex file names based on the content of the source folder and
-    the fact that it contains or not a \documentclass{} declaration
+    the fact that it contains or not a \documentclass{} declaration, from the project index
     """
-    filenames = []
-    dc_pattern = re.compile(r"\\documentclass(\[[^\]]*\])*{[^}]*}")
-    texfile_pattern = re.compile(r".*\.tex")
-    for root, _, files in os.walk(app.config['UPLOAD_FOLDER']):
-        for filename in files:
-            if texfile_pattern.match(filename):
-                path = os.path.join(root, filename)
-                with open(path) as file:
-                    data = file.read()
-                    if any(li for li in data.splitlines() if dc_pattern.match(li)):
-                        filenames.append(os.path.relpath(path, "vary/source"))
-
-    return json.dumps(filenames)
+    return json.dumps(get_main_files(app.config['UPLOAD_FOLDER']))
 
 
 @app.route('/config_src')
@@ -51,16 +40,32 @@ def config_src():
     return send_from_directory("source", VARIABLE_FILE_NAME)
 
 
+@app.route('/variable_usage')
+def variable_usage():
+    """
+    Gets the files and macros that use each variable of the project, and the variables that the document never
+    reads because they are unused or only appear in files that are not included.
+    """
+    project_folder = app.config['UPLOAD_FOLDER']
+    with open(os.path.join(project_folder, VARIABLE_FILE_NAME)) as f:
+        conf_source = json.load(f)
+    analysis = analyze_variables(os.path.join(project_folder, session['main_file_name']), conf_source)
+    return json.dumps(analysis), 200, {'Content-Type': 'application/json'}
+
+
 @app.route('/auto_variables', methods=["GET", "POST"])
 def auto_variables():
     if request.method == "POST":
         project_folder = app.config['UPLOAD_FOLDER']
         main_file_path = os.path.join(project_folder, session['main_file_name'])
         form = request.form
+        injections = []
         if form.get('generateImageSizes'):
-            add_graphics_variables(main_file_path)
+            injections.append("graphics")
         if form.get("generateItemsep"):
-            add_itemsep_variable(main_file_path)
+            injections.append("itemsep")
+        # The chosen variables are added in a single pass over the files
+        prepare_project(main_file_path, injections)
 
         return redirect(url_for('mode'))
 